@@ -0,0 +1,263 @@
+"""
+Run sync and heart-rate estimation over a whole archive of recordings.
+
+The archive is laid out as the recorders write it, i.e. ECG files in
+ecg-files/DATA/<yyyymmdd>/<hh-mm-ss>.EDF and watch recordings in
+files/recordings/<yyyy-mm-dd>/<hh.mm.ss.sss>/. Each watch recording is paired
+with the ECG file which started closest to it, before or after.
+
+Pairs are processed in parallel, one per process. The results for each pair are
+written to their own file in the output directory as soon as they are done, so
+a job which is restarted skips the pairs it has already finished. Once all pairs
+are done the per-pair files are combined into results.csv.
+"""
+import concurrent.futures
+import datetime
+import glob
+import os
+import sys
+import traceback
+import numpy as np
+import pandas
+import filtering
+import heartrate
+import joss
+import sync
+
+ECG_DIRECTORY = os.path.join("ecg-files", "DATA")
+WATCH_DIRECTORY = os.path.join("files", "recordings")
+RESULTS_FILE = "results.csv"
+
+# Watch recordings starting more than this long before or after the ECG aren't paired with it
+MAX_PAIR_GAP = datetime.timedelta(hours=2)
+
+# Seconds the ECG heart-rate is averaged over. Its first ECG_HR_AVE_SIZE // 2 seconds are
+# padded (see heartrate.get_ecg_hr), so estimates there aren't compared with it.
+ECG_HR_AVE_SIZE = 16
+
+
+def findRecordings(root):
+    """
+    Find and pair the ECG files and watch recordings in an archive.
+
+    Parameters
+    ----------
+    root : str
+        Directory containing ecg-files/ and files/
+
+    Returns
+    -------
+    out : list of (str, str, str)
+        The name of each pair, its ECG file and its watch recording directory,
+        in order of recording time. Watch recordings without an ECG file within
+        MAX_PAIR_GAP are left out, and reported.
+    """
+    ecgFiles = []
+    for path in glob.glob(os.path.join(root, ECG_DIRECTORY, "*", "*.EDF")):
+        date = os.path.basename(os.path.dirname(path))
+        time = os.path.splitext(os.path.basename(path))[0]
+        try:
+            start = datetime.datetime.strptime(date + time, "%Y%m%d%H-%M-%S")
+        except ValueError:
+            continue
+        ecgFiles.append((start, path))
+    ecgFiles.sort()
+
+    pairs = []
+    for path in sorted(glob.glob(os.path.join(root, WATCH_DIRECTORY, "*", "*", ""))):
+        path = os.path.normpath(path)
+        date = os.path.basename(os.path.dirname(path))
+        time = os.path.basename(path)
+        try:
+            start = datetime.datetime.strptime(date + time, "%Y-%m-%d%H.%M.%S.%f")
+        except ValueError:
+            continue
+
+        near = [ecg for ecg in ecgFiles if abs(start - ecg[0]) <= MAX_PAIR_GAP]
+        if len(near) == 0:
+            print("No ECG file within {} of {}, skipping it".format(MAX_PAIR_GAP, path))
+            continue
+        closest = min(near, key=lambda ecg: abs(start - ecg[0]))
+
+        name = start.strftime("%Y-%m-%d_%H.%M.%S")
+        pairs.append((name, closest[1], path))
+
+    return pairs
+
+
+def _filteredPPG(synced):
+    return filtering.butter_bandpass_filter(synced.getSyncedPPG(), 20/60, 220/60, order=6)
+
+
+def estimateSD(synced):
+    hr = heartrate.get_ppg_hr(_filteredPPG(synced), method='sd')
+    return np.arange(hr.size), hr
+
+
+def estimateNaive(synced):
+    hr = heartrate.get_ppg_hr(_filteredPPG(synced), method='naive')
+    return np.arange(hr.size), hr
+
+
+def estimateWatch(synced):
+    hr = synced.getSyncedHR().getValues()
+    return np.arange(hr.size), hr
+
+
+def estimateJoss(synced, window_size=8, shift=4):
+    hr = joss.joss(synced, window_size=window_size, shift=shift)
+    # Each estimate covers the window_size seconds before it
+    return np.arange(hr.size) * shift + window_size, hr
+
+
+def estimateKalman(synced):
+    import earbuds
+    import kalmanfilter
+    # Share synced's recordings and crop, so the heart-rates cover the same time as the ECG's
+    earSynced = earbuds.Sync(synced.ecgFile, synced.watchDirectory,
+            startCrop=synced.startCrop, endCrop=synced.endCrop,
+            ecgData=synced.ecgData, watchData=synced.watchData)
+    hr = kalmanfilter.Filter(earSynced.ear, earSynced.hr).filter().getValues()
+    return np.arange(hr.size), hr
+
+
+# Heart-rate estimators which can be run, each takes a Sync and returns the
+# times (seconds since the synced start) and heart-rates it estimated
+ESTIMATORS = {
+    "sd": estimateSD,
+    "naive": estimateNaive,
+    "watch": estimateWatch,
+    "joss": estimateJoss,
+    "kalman": estimateKalman,
+}
+
+
+def processPair(name, ecgFile, watchDirectory, estimators, drift=False):
+    """
+    Sync one pair of recordings and run each estimator on it, compensating for
+    the drift between their clocks if drift (see sync.Sync.getClockDrift).
+
+    Returns
+    -------
+    out : pandas.DataFrame
+        One row per estimate, with the offset between the recordings and the
+        drift of the watch's clock (0 unless drift), the estimated and ECG
+        heart-rates and the error between them
+    """
+    synced = sync.getSync(ecgFile, watchDirectory)
+    synced.setDriftCompensation(drift)
+
+    if drift:
+        offset, clockDrift = synced.getClockDrift()
+    else:
+        offset, clockDrift = synced.getTimeDifference(), 0
+    ecgHR = heartrate.get_ecg_hr(synced.getSyncedECG(), ECG_HR_AVE_SIZE)
+
+    tables = []
+    for estimator in estimators:
+        times, hr = ESTIMATORS[estimator](synced)
+        keep = (times >= ECG_HR_AVE_SIZE // 2) & (times < ecgHR.size)
+        times = times[keep]
+        hr = hr[keep]
+        tables.append(pandas.DataFrame({
+            "recording": name,
+            "estimator": estimator,
+            "offset": offset,
+            "drift": clockDrift,
+            "time": times,
+            "hr": hr,
+            "ecg_hr": ecgHR[times],
+            "error": hr - ecgHR[times],
+        }))
+
+    return pandas.concat(tables, ignore_index=True)
+
+
+def _runPair(name, ecgFile, watchDirectory, estimators, outputDirectory, drift):
+    """
+    Process a pair in a worker, saving its results to a file of its own
+    """
+    table = processPair(name, ecgFile, watchDirectory, estimators, drift)
+    path = os.path.join(outputDirectory, name + ".csv")
+
+    # Write then rename, so a crash never leaves a partial file that looks finished
+    table.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return name
+
+
+def runBatch(root, outputDirectory, estimators=("sd",), workers=None, drift=False):
+    """
+    Process every pair of recordings in root which doesn't yet have results in
+    outputDirectory, then combine all results into outputDirectory/results.csv.
+
+    Parameters
+    ----------
+    root : str
+        Directory containing ecg-files/ and files/
+
+    outputDirectory : str
+        Directory to save results in, shared between runs to allow resuming
+
+    estimators : list of str
+        Names of the estimators (keys of ESTIMATORS) to run
+
+    workers : int or None
+        Number of processes to use, None for one per core
+
+    drift : bool
+        Compensate for the drift between the watch's and ECG's clocks
+
+    Returns
+    -------
+    out : pandas.DataFrame
+        The combined results
+    """
+    for estimator in estimators:
+        if not estimator in ESTIMATORS:
+            raise ValueError("Unknown estimator {}, valid estimators are {}"
+                    .format(estimator, ", ".join(ESTIMATORS)))
+
+    os.makedirs(outputDirectory, exist_ok=True)
+    pairs = findRecordings(root)
+    todo = [pair for pair in pairs 
+            if not os.path.isfile(os.path.join(outputDirectory, pair[0] + ".csv"))]
+    print("{} pairs found, {} already done".format(len(pairs), len(pairs) - len(todo)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_runPair, name, ecgFile, watchDirectory, 
+            estimators, outputDirectory, drift): name for name, ecgFile, watchDirectory in todo}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                print("Finished {}".format(future.result()))
+            except Exception:
+                print("Failed {}".format(futures[future]))
+                traceback.print_exc()
+
+    done = [os.path.join(outputDirectory, pair[0] + ".csv") for pair in pairs]
+    done = [path for path in done if os.path.isfile(path)]
+    if len(done) == 0:
+        return None
+
+    results = pandas.concat([pandas.read_csv(path) for path in done], ignore_index=True)
+    results.to_csv(os.path.join(outputDirectory, RESULTS_FILE), index=False)
+    return results
+
+
+if __name__ == "__main__":
+    # --drift compensates for the drift between the clocks, wherever it's given
+    args = [arg for arg in sys.argv[1:] if arg != "--drift"]
+    drift = len(args) < len(sys.argv) - 1
+    if len(args) < 2:
+        raise ValueError("Expected usage: batch.py [--drift] archiveDir outputDir (estimator...)")
+
+    root = args[0]
+    outputDirectory = args[1]
+    estimators = args[2:] if len(args) > 2 else ["sd"]
+
+    results = runBatch(root, outputDirectory, estimators, drift=drift)
+
+    if results is not None:
+        results["abs_error"] = results["error"].abs()
+        print(results.groupby("estimator")["abs_error"].mean())
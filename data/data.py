@@ -1,34 +1,170 @@
+import copy
+import functools
+from fractions import Fraction
 import numpy as np
+import scipy.interpolate
+import scipy.signal
 import matplotlib.pyplot as plt
 
+# Signals share their values (with the arrays they're made from, slices and crops
+# of them, and getValues) as read-only views, and only copy them when they're set
+# (copy-on-write). Use .copy() to get values which can be changed. False gives
+# every Signal and getValues its own copy instead.
+COPY_ON_WRITE = True
+
+# Largest denominator of the fraction approximating the ratio of frequencies when
+# resampling with the polyphase method
+RESAMPLE_MAX_DENOMINATOR = 1000
+
+
+def shareValues(values):
+    """
+    Return values to be shared by a Signal: a read-only view of them, or a copy if
+    not COPY_ON_WRITE
+    """
+    if not COPY_ON_WRITE:
+        return np.array(values)
+    view = np.asarray(values).view()
+    view.flags.writeable = False
+    return view
+
+
 def getSignal(values, frequency):
     return Signal(values, frequency)
 
 
+@functools.lru_cache(maxsize=None)
+def polyphaseFilter(up, down):
+    """
+    Design the anti-aliasing FIR filter for resampling by up / down (in lowest
+    terms), the same as scipy.signal.resample_poly's default. Designs are
+    cached, so resampling between the same rates only designs it once.
+    """
+    rate = max(up, down)
+    return scipy.signal.firwin(20 * rate + 1, 1 / rate, window=('kaiser', 5.0))
+
+
+def getTimedSignal(values, times, frequency=None):
+    return TimedSignal(values, times, frequency)
+
+
+def averageFrequency(times):
+    """
+    Calculate the average sampling frequency (hz) from the timestamps (ms) of samples
+    """
+    return times.size / ((times[times.size-1] - times[0]) / 1000)
+
+
+def resampleTimes(values, times, freq, method="linear", start=None):
+    """
+    Resample values recorded at irregular times (e.g. with jitter and dropped
+    samples) onto a uniform grid, in one pass.
+
+    Parameters
+    ----------
+     - values : 1D numpy array
+       The recorded values
+
+     - times : 1D numpy array
+       The time (ms) each value was recorded, in order. Repeated times are dropped.
+
+     - freq : float
+       Frequency (hz) of the uniform grid
+
+     - method : str
+       "linear" or "cubic" interpolation, or "polyphase" or "fft": linear
+       interpolation at a multiple of freq (at least the average rate of times),
+       then down-sampled to freq by Signal.resample with the method
+
+     - start : float
+       Time (ms) the grid starts at, the first time if None
+
+    Returns
+    ----------
+     - out : 1D numpy array
+       The values at start + k / freq seconds, for k until the last time
+    """
+    keep = np.diff(times, prepend=times[0] - 1) > 0
+    times = times[keep]
+    values = values[keep]
+    offsets = (times - (times[0] if start is None else start)) / 1000
+    size = int(offsets[-1] * freq) + 1
+
+    if method == "linear":
+        return np.interp(np.arange(size) / freq, offsets, values)
+    elif method == "cubic":
+        return scipy.interpolate.CubicSpline(offsets, values)(np.arange(size) / freq)
+    elif method in ("polyphase", "fft"):
+        up = max(int(np.ceil(averageFrequency(times) / freq)), 1)
+        fine = np.interp(np.arange(size * up) / (freq * up), offsets, values)
+        return getSignal(fine, freq * up).resample(freq, method).getValues()
+    else:
+        raise ValueError("Unknown resampling method {}".format(method))
+
+
+def getMultiSignal(signals):
+    """
+    Stack signals with the same frequency (e.g. PPG and acceleration axes, once
+    resampled) as the channels of one MultiSignal, cropped to the shortest
+    """
+    frequencies = {signal.getFrequency() for signal in signals}
+    if len(frequencies) != 1:
+        raise ValueError("Expected signals with the same frequency, got {}".format(frequencies))
+
+    size = min(signal.size for signal in signals)
+    values = np.empty((len(signals), size))
+    for channel, signal in zip(values, signals):
+        channel[:] = signal.vals[:size]
+    return MultiSignal(values, frequencies.pop())
+
+
 class Signal():
+    """
+    A signal sampled at a uniform frequency (hz).
+
+    The signal doesn't copy the array it's made from (see COPY_ON_WRITE): it
+    keeps a read-only view of it, so the caller's array and the signal share
+    their values. Changing the array afterwards changes the signal too, so
+    pass a copy if the array is going to be changed. Setting the signal's
+    values (signal[key] = ...) copies them first, so that never changes the
+    array, or other signals sharing it.
+    """
     def __init__(self, values, frequency):
-        self.vals = values.copy()
+        self.vals = shareValues(values)
         self.freq = frequency
 
     def getValues(self):
-        return self.vals.copy()
+        return shareValues(self.vals)
 
     def getFrequency(self):
         return self.freq
 
+    def copy(self):
+        """
+        Return a copy of the signal, whose values are its own and can be changed
+        """
+        signal = copy.copy(self)
+        signal.vals = self.vals.copy()
+        return signal
+
     def plot(self, label=""):
         xs = np.arange(0, self.vals.size/self.freq, 1/self.freq)[:self.size]
         plt.plot(xs, self.vals, label=label)
 
     def normalize(self):
-        newVals = self.vals
-        mean = np.mean(newVals)
-        newVals -= mean
+        newVals = self.vals - np.mean(self.vals)
         amplitude = np.absolute(newVals).max()
         newVals /= amplitude
         return getSignal(newVals, self.freq)
 
     def resample(self, freq, method="linear"):
+        """
+        Resample to freq (hz). method is "linear" interpolation, "polyphase"
+        (scipy.signal.resample_poly, anti-aliased, with the ratio of frequencies
+        approximated by a fraction with denominator at most RESAMPLE_MAX_DENOMINATOR,
+        and what's left interpolated) or "fft" (scipy.signal.resample, which
+        assumes the signal is periodic).
+        """
         if method == "linear":
             resampled = np.interp(
                     np.arange(0, self.vals.size, self.freq/freq),
@@ -36,14 +172,34 @@ class Signal():
                     self.vals)
             return getSignal(resampled, freq)
 
+        elif method == "polyphase":
+            ratio = Fraction(freq / self.freq).limit_denominator(RESAMPLE_MAX_DENOMINATOR)
+            up, down = ratio.numerator, ratio.denominator
+            if up == down:
+                resampled = self.vals
+            else:
+                resampled = scipy.signal.resample_poly(self.vals, up, down,
+                        window=polyphaseFilter(up, down))
+
+            # Interpolate away the difference between the ratio and its
+            # approximation, so long signals don't drift
+            if up / down != freq / self.freq:
+                resampled = np.interp(
+                        np.arange(0, resampled.size, self.freq * up / down / freq),
+                        np.arange(0, resampled.size, 1),
+                        resampled)
+            return getSignal(resampled, freq)
+
+        elif method == "fft":
+            size = int(round(self.vals.size * freq / self.freq))
+            return getSignal(scipy.signal.resample(self.vals, size), freq)
+
         else:
             raise ValueError("Unknown resampling method {}".format(method))
 
 
     def crop(self, length):
-        values = self.getValues()[:length]
-        newSignal = getSignal(values, self.freq)
-        return newSignal
+        return getSignal(self.vals[:length], self.freq)
 
     def __getitem__(self, key):
         item = self.vals[key] 
@@ -55,6 +211,9 @@ class Signal():
 
 
     def __setitem__(self, key, item):
+        # Copy shared values before changing them
+        if not self.vals.flags.writeable:
+            self.vals = self.vals.copy()
         self.vals[key] = item
 
     def __delitem__(self, key):
@@ -70,4 +229,80 @@ class Signal():
 
     @property
     def values(self):
-        return self.vals.copy()
+        return shareValues(self.vals)
+
+
+class TimedSignal(Signal):
+    """
+    A signal which keeps the time (ms) each sample was recorded at, e.g. by the
+    watch, whose sampling isn't quite uniform. Its frequency is the average
+    rate, unless given. Slices and crops keep their samples' times, and
+    resample uses the times, so jitter and dropped samples don't add up to
+    drift over long recordings.
+    """
+    def __init__(self, values, times, frequency=None):
+        super().__init__(values, averageFrequency(times) if frequency is None else frequency)
+        self.times = shareValues(times)
+
+    def getTimes(self):
+        return shareValues(self.times)
+
+    def normalize(self):
+        return getTimedSignal(super().normalize().vals, self.times, self.freq)
+
+    def resample(self, freq, method="linear"):
+        """
+        Resample onto a uniform grid at freq (hz) from the first sample's time, see
+        resampleTimes for the methods. Returns a (uniform) Signal.
+        """
+        return getSignal(resampleTimes(self.vals, self.times, freq, method), freq)
+
+    def crop(self, length):
+        return getTimedSignal(self.vals[:length], self.times[:length], self.freq)
+
+    def __getitem__(self, key):
+        item = self.vals[key] 
+
+        if item.size == 1:
+            return item
+
+        return getTimedSignal(item, self.times[key], self.freq)
+
+
+class MultiSignal():
+    """
+    Several signals sampled together, as a 2D (channels x samples) array, so
+    they can be processed in one go, e.g. filtered by filtering.BandpassFilter.
+    Values are shared in the same way as Signal's (see COPY_ON_WRITE).
+    """
+    def __init__(self, values, frequency):
+        self.vals = shareValues(np.atleast_2d(values))
+        self.freq = frequency
+
+    def getValues(self):
+        return shareValues(self.vals)
+
+    def getFrequency(self):
+        return self.freq
+
+    def getChannel(self, channel):
+        return getSignal(self.vals[channel], self.freq)
+
+    def getChannels(self):
+        return [self.getChannel(channel) for channel in range(self.channels)]
+
+    @property
+    def channels(self):
+        return self.vals.shape[0]
+
+    @property
+    def size(self):
+        return self.vals.shape[1]
+
+    @property
+    def frequency(self):
+        return self.freq
+
+    @property
+    def values(self):
+        return shareValues(self.vals)
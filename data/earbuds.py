@@ -1,11 +1,11 @@
 import heartrate
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas
 import sys
 import sync
 import os
 import data
+import watchdata
 
 class EarbudData:
     def __init__(self, directory, old_style = False):
@@ -18,22 +18,32 @@ class EarbudData:
         self.directory = directory
         self.old_style = old_style
         self.file_name = "hr.csv" if old_style else "ear.csv"
+        self._columns = None
+
+    def _getColumns(self):
+        """
+        Parse the earbud file the first time it is needed, and reuse it afterwards
+        """
+        if self._columns is None:
+            self._columns = watchdata.loadColumns(
+                    os.path.join(self.directory, self.file_name), 
+                    watchdata.COLUMNS[self.file_name])
+        return self._columns
 
 
     @property
     def times(self):
-        df = pandas.read_csv(os.path.join(self.directory, self.file_name))
-        time = df['time'].to_numpy()
-        return time
+        time = self._getColumns()['time']
+        return time.copy()
     
     
     def get_hr(self):
         """
         Get heart-rate as a start time and a numpy array of the heart-rate
         """
-        df = pandas.read_csv(os.path.join(self.directory, self.file_name))
-        hr = df['value'].to_numpy()
-        time = df['time'].to_numpy()
+        columns = self._getColumns()
+        hr = columns['value'].copy()
+        time = columns['time']
 
         # Calculate frequency in hz
         freq = time.size / ((time[time.size-1] - time[0]) / 1000)
@@ -43,21 +53,23 @@ class EarbudData:
 
 
 class Sync(sync.Sync):
-    def __init__(self, ecgFile, watchDirectory, earbudDirectory=None):
+    def __init__(self, ecgFile, watchDirectory, earbudDirectory=None, startCrop=0, endCrop=1,
+            ecgData=None, watchData=None):
         """
         Parameters
         ------------------
          - earbudDirectory = None means the ear files are in the watch directory
-         - hr - True if using the HR, false if using PPG
+         - startCrop, endCrop - seconds cropped from the start and end of the synced signals
+         - ecgData, watchData - already opened recordings to share, see sync.Sync
         """
         if earbudDirectory is None:
             self.ear_data = EarbudData(watchDirectory,False)
         else:
             self.ear_data = EarbudData(earbudDirectory,True)
 
-        super().__init__(ecgFile, watchDirectory)
-        super().setStartCrop(0)
-        super().setEndCrop(1)
+        super().__init__(ecgFile, watchDirectory, ecgData, watchData)
+        super().setStartCrop(startCrop)
+        super().setEndCrop(endCrop)
         try:
             super().getSyncedPPG()
             self._ecg, self._ppg, self._ear = self.get_synced_signals()
@@ -65,16 +77,10 @@ class Sync(sync.Sync):
 
         except:
             self._ecg = self.getSyncedECG()
-            self._ear = data.getSignal(self.ear_data.get_hr()[1], 1)
+            self._ear = self._syncEar(data.getSignal(self.ear_data.get_hr()[1], 1))
             self._hr = self.getSyncedHR()
             self._ppg = None
 
-            time_diff = self.getTimeDifference()
-            delta = int(abs(time_diff))
-
-            if time_diff < 0:
-                self._ear = self._ear[delta:]
-
 
 
             
@@ -92,13 +98,30 @@ class Sync(sync.Sync):
     def ear(self):
         return self._ear
 
+    def _syncEar(self, ear):
+        """
+        Trim the ear signal (at 1 hz) as the watch signals are when synced, so it
+        starts and ends at the same time as they do
+        """
+        time_diff = self.getTimeDifference()
+        delta = int(abs(time_diff))
+
+        if time_diff < 0:
+            ear = ear[delta:]
+        return self.crop(ear)
+
     def get_synced_signals(self):
         ecg = self.getSyncedECG()
         ppg = self.getSyncedPPG()
-        ear = data.getSignal(self.ear_data.get_hr()[1], 1)
+        ear = self._syncEar(data.getSignal(self.ear_data.get_hr()[1], 1))
 
+        # The times of the samples kept by syncing, so the crops below index the synced signals
+        ear_times = self._syncEar(data.getSignal(self.ear_data.times, 1)).getValues()
         ppg_times = self.watchData.times
-        ear_times = self.ear_data.times
+        time_diff = self.getTimeDifference()
+        if time_diff < 0:
+            ppg_times = ppg_times[int(abs(time_diff) * ppg.frequency):]
+        ppg_times = self.crop(data.getSignal(ppg_times, ppg.frequency)).getValues()
 
         # starting times for PPG signal and earbud signal, given in ms
         ppg_start = ppg_times[0]
@@ -1,6 +1,7 @@
 import pyedflib
 import data
 import heartpy as hp
+import recordingcache
 
 DEBUG = False
 
@@ -9,27 +10,110 @@ def getEcgData(ecgFilePath):
 
 
 class EcgData:
+    """
+    Reads the channels of an EDF file from the portable ECG. If the file has a
+    fresh binary cache (see recordingcache) the channels are memory-mapped from
+    that instead, and the EDF file is never opened.
+
+    Sample frequencies and channel lengths come from the header, without
+    reading any samples. Channels can be read in part, given a start time and
+    length in seconds, and channels which have been read in full are kept so
+    they are only decoded once.
+    """
     def __init__(self, ecgFilePath):
-        self.ecgFile = pyedflib.EdfReader(ecgFilePath)
-        self.labels = self.ecgFile.getSignalLabels()
+        cached = recordingcache.load(ecgFilePath)
+        self.decoded = {}
+        if cached is None:
+            self.ecgFile = pyedflib.EdfReader(ecgFilePath)
+            self.labels = self.ecgFile.getSignalLabels()
+            self.channels = None
+        else:
+            self.ecgFile = None
+            self.channels, metadata = cached
+            self.labels = metadata["labels"]
+            self.frequencies = metadata["frequencies"]
+
+    def _getPosition(self, label):
+        if not label in self.labels:
+            raise ValueError("ECG file has no channel {}".format(label))
+        return self.labels.index(label)
 
-    def getAcceleration(self, axis):
+    def _getAccelerationLabel(self, axis):
         if not axis.upper() in ['X','Y','Z']:
             raise ValueError("Argument axis must be one of x, y or z.")
+        return "Accelerometer_{}".format(axis.upper())
+
+    def getFrequency(self, label):
+        """
+        Return the sample frequency (hz) of the channel label, from the header
+        """
+        pos = self._getPosition(label)
+        if self.ecgFile is None:
+            return self.frequencies[pos]
+        return self.ecgFile.getSampleFrequency(pos)
+
+    def getLength(self, label):
+        """
+        Return the number of samples in the channel label, from the header
+        """
+        pos = self._getPosition(label)
+        if self.ecgFile is None:
+            return self.channels[label].size
+        return int(self.ecgFile.getNSamples()[pos])
+
+    def getDuration(self, label):
+        """
+        Return the length in seconds of the channel label
+        """
+        return self.getLength(label) / self.getFrequency(label)
+
+    def getChannel(self, label, start=0, length=None):
+        """
+        Read a channel of the EDF file as a signal.
+
+        Parameters
+        ----------
+         - label : str
+           The label of the channel, e.g. "ECG" or "Accelerometer_X"
+
+         - start : float
+           Time, in seconds, from which to start reading
+
+         - length : float or None
+           Number of seconds to read, None to read to the end of the channel
+
+        Returns
+        ----------
+         - out : data.Signal
+           The samples read
+        """
+        pos = self._getPosition(label)
+        freq = self.getFrequency(label)
+        total = self.getLength(label)
+
+        first = min(int(start * freq), total)
+        n = total - first if length is None else min(int(length * freq), total - first)
+
+        if label in self.decoded:
+            signal = self.decoded[label][first:first + n]
+        elif self.ecgFile is None:
+            signal = self.channels[label][first:first + n]
+        else:
+            signal = self.ecgFile.readSignal(pos, start=first, n=n)
+            if first == 0 and n == total:
+                self.decoded[label] = signal
 
-        pos = self.labels.index("Accelerometer_{}".format(axis.upper()))
-        freq = self.ecgFile.getSampleFrequency(pos)
-        signal = self.ecgFile.readSignal(pos)
         if DEBUG:
-            print("ECG data, acceleration {}. Frequency {} and signal length {}"
-                    .format(axis, freq, signal.size))
-        ecg = data.getSignal(signal, freq)
-        return ecg
-
-
-    def getECG(self):
-        pos = self.labels.index("ECG")
-        freq = self.ecgFile.getSampleFrequency(pos)
-        signal = self.ecgFile.readSignal(pos)
-        ecg = data.getSignal(signal, freq)
-        return ecg
+            print("ECG data, channel {}. Frequency {} and signal length {}"
+                    .format(label, freq, signal.size))
+        return data.getSignal(signal, freq)
+
+    def getAccelerationFrequency(self, axis):
+        return self.getFrequency(self._getAccelerationLabel(axis))
+
+    def getAcceleration(self, axis, start=0, length=None):
+        return self.getChannel(self._getAccelerationLabel(axis), start, length)
+
+
+    def getECG(self, start=0, length=None):
+        return self.getChannel("ECG", start, length)
@@ -1,28 +1,135 @@
-from scipy.signal import butter, lfilter, cheby2, sosfilt
+import functools
+from scipy.signal import butter, cheby2, sosfilt, sosfiltfilt
 import sys
 import matplotlib.pyplot as plt
 import numpy as np
 import sync
 import data
 
+# Stop-band attenuation (dB) of the Chebyshev type II filters
+CHEBY2_ATTENUATION = 30
+
+
+@functools.lru_cache(maxsize=None)
+def design_bandpass(kind, order, lowcut, highcut, freq):
+    """
+    Design a band-pass filter as second-order sections. Designs are cached, so
+    filters with the same parameters share them (and mustn't modify them).
+
+    Parameters
+    ----------
+     - kind : str
+       "butter" for Butterworth or "cheby2" for Chebyshev type II
+
+     - order : int
+       Order of the filter
+
+     - lowcut, highcut : float
+       Edges of the pass band (hz)
+
+     - freq : float
+       Sample frequency (hz)
+
+    Returns
+    ----------
+     - sos : 2D numpy array
+       The filter's second-order sections
+    """
+    if kind == "butter":
+        sos = butter(order, [lowcut, highcut], btype='band', fs=freq, output='sos')
+    elif kind == "cheby2":
+        sos = cheby2(order, CHEBY2_ATTENUATION, [lowcut, highcut], btype='band', 
+                fs=freq, output='sos')
+    else:
+        raise ValueError("Expected kind to be butter or cheby2, got {}".format(kind))
+    return sos
+
+
+class BandpassFilter:
+    """
+    A band-pass filter, designed once (see design_bandpass), which can filter
+    whole signals or be fed one a chunk at a time, e.g. blocks of PPG as they
+    arrive. When streaming, the filter state is carried from one chunk to the
+    next, so the output is exactly what filtering the whole signal would give,
+    with no transients at chunk boundaries.
+
+    Signals can have several channels (a data.MultiSignal, or 2D chunks of
+    channels x samples), which are all filtered in one call along the last axis.
+    """
+    def __init__(self, lowcut, highcut, freq, order=4, kind="butter"):
+        """
+        Parameters
+        ------------
+         - lowcut, highcut - edges of the pass band (hz)
+         - freq - sample frequency (hz)
+         - order - order of the filter
+         - kind - "butter" for Butterworth or "cheby2" for Chebyshev type II
+        """
+        self.freq = freq
+        self.sos = design_bandpass(kind, order, lowcut, highcut, freq)
+        self.zi = None
+
+    def reset(self):
+        """
+        Forget the filter state, to start filtering a new stream
+        """
+        self.zi = None
+
+    def process(self, chunk):
+        """
+        Filter the next chunk of a stream
+
+        Parameters
+        ------------
+         - chunk - the next samples, a numpy array (channels x samples if 2D)
+
+        Returns
+        ------------
+         - The filtered samples, a numpy array
+        """
+        if self.zi is None:
+            self.zi = np.zeros((self.sos.shape[0],) + chunk.shape[:-1] + (2,))
+        filtered, self.zi = sosfilt(self.sos, chunk, zi=self.zi, axis=-1)
+        return filtered
+
+    def filter(self, signal, zero_phase=False):
+        """
+        Filter a whole signal, independently of any stream being processed
+
+        Parameters
+        ------------
+         - signal - data.Signal, data.TimedSignal or data.MultiSignal to filter, at the
+           filter's frequency
+         - zero_phase - filter forwards and backwards (sosfiltfilt), so there's no
+           phase shift (and twice the attenuation)
+
+        Returns
+        ------------
+         - The filtered signal, of the same kind (a TimedSignal keeps its times)
+        """
+        if signal.getFrequency() != self.freq:
+            raise ValueError("Expected a signal at {} hz, got {} hz"
+                    .format(self.freq, signal.getFrequency()))
+        if zero_phase:
+            filtered = sosfiltfilt(self.sos, signal.vals, axis=-1)
+        else:
+            filtered = sosfilt(self.sos, signal.vals, axis=-1)
+
+        if isinstance(signal, data.TimedSignal):
+            return data.getTimedSignal(filtered, signal.times, self.freq)
+        if isinstance(signal, data.MultiSignal):
+            return data.MultiSignal(filtered, self.freq)
+        return data.getSignal(filtered, self.freq)
+
+
 def butter_bandpass_filter(signal, lowcut, highcut, order=4): 
     freq = signal.getFrequency()
-    samples = signal.getValues()
-    nyq = freq / 2
-    low = lowcut / nyq 
-    high = highcut / nyq 
-    b, a = butter(order, [low, high], btype='band')
-    filtered = lfilter(b, a, samples)
-    return data.getSignal(filtered, freq)
+    return BandpassFilter(lowcut, highcut, freq, order).filter(signal)
 
 
 def chebyshev2_filter(signal, lowcut, highcut, order=2):
     freq = signal.getFrequency()
-    samples = signal.getValues()
-    sos = cheby2(order, 30, [lowcut,highcut], btype='band', 
-            fs=freq, output='sos')
-    filtered = sosfilt(sos, samples)
-    return data.getSignal(filtered, freq)
+    return BandpassFilter(lowcut, highcut, freq, order, kind="cheby2").filter(signal)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import concurrent.futures
 import sync
 import sys
 import numpy as np
@@ -6,17 +7,132 @@ import peakfind
 import data
 import motionfilter
 import heartpy as hp
+import scipy.signal
 from scipy.signal import resample
 import matplotlib.pyplot as plt
 
 PLOTTING = True
 HEARTPY_SEGS = True
 
+# Length (s) of the chunks the ECG is split into to find R-peaks in parallel, and the
+# overlap (s) either side of each, so peaks near the edges are found with some context
+ECG_CHUNK_SIZE = 600
+ECG_CHUNK_OVERLAP = 10
 
-def get_ecg_hr(signal, ave_size = 16):
+# Number of preceding R-R intervals whose mean reject_r_peaks_running compares each with
+RR_RUNNING_COUNT = 16
+
+
+def find_r_peaks(vals, freq):
+    """
+    Find the R-peaks in a (baseline filtered) ECG with HeartPy, in one pass.
+
+    Returns
+    ----------------------
+     - peaks: 1D numpy array
+       Position of each R-peak
+
+     - accepted: 1D numpy array
+       Whether each peak was accepted by HeartPy's peak rejection
+    """
+    wd, m = hp.process(vals, freq, bpmmax=220)
+    return np.asarray(wd['peaklist']), np.asarray(wd['binary_peaklist'], dtype=bool)
+
+
+def _find_chunk_r_peaks(vals, freq, start, stop):
+    """
+    Find the R-peaks in vals, keeping those in [start, stop)
+    """
+    try:
+        peaks, _ = find_r_peaks(vals, freq)
+    except hp.exceptions.BadSignalWarning:
+        return np.zeros(0, dtype=int)
+    return peaks[(peaks >= start) & (peaks < stop)]
+
+
+def reject_r_peaks(peaks, freq):
+    """
+    Reject R-peaks as HeartPy does, those after an interval more than 30% (or
+    300 ms) from the mean interval.
+
+    Returns
+    ----------------------
+     - accepted: 1D numpy array
+       Whether each peak was accepted
+    """
+    intervals = (np.diff(peaks) / freq) * 1000.0
+    mean_interval = np.mean(intervals)
+    margin = max(0.3 * mean_interval, 300)
+
+    accepted = np.ones(peaks.size, dtype=bool)
+    accepted[1:] = (intervals > mean_interval - margin) & (intervals < mean_interval + margin)
+    return accepted
+
+
+def find_r_peaks_parallel(vals, freq, workers=None):
+    """
+    Find the R-peaks in a (baseline filtered) ECG, as find_r_peaks, but in
+    chunks of ECG_CHUNK_SIZE seconds in a pool of processes. Each chunk is
+    given ECG_CHUNK_OVERLAP seconds of context either side, and only keeps the
+    peaks in its own part of the ECG. Peaks are rejected over the whole ECG
+    once they're stitched together, as the rejection depends on the mean
+    interval.
+    """
+    size = int(ECG_CHUNK_SIZE * freq)
+    overlap = int(ECG_CHUNK_OVERLAP * freq)
+    starts = range(0, vals.size, size)
+
+    offsets = [max(start - overlap, 0) for start in starts]
+    chunks = [vals[offset:start + size + overlap] for start, offset in zip(starts, offsets)]
+    lower = [start - offset for start, offset in zip(starts, offsets)]
+    upper = [start - offset + size for start, offset in zip(starts, offsets)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_find_chunk_r_peaks, chunks, [freq] * len(chunks), lower, upper)
+        peaks = np.concatenate([peaks + offset for peaks, offset in zip(results, offsets)])
+
+    return peaks, reject_r_peaks(peaks, freq)
+
+
+def windowed_bpm(peaks, accepted, freq, windows):
+    """
+    Calculate the BPM in each of a set of windows from one list of R-peaks, as
+    HeartPy's process_segmentwise does in 'fast' mode: the mean of the intervals
+    between consecutive peaks in the window which were both accepted. Running
+    sums of the intervals make each window constant time.
+
+    Inputs
+    ----------------------
+     - peaks, accepted: 1D numpy arrays
+       R-peaks, as from find_r_peaks
+
+     - windows: 2D numpy array
+       The (start, stop) of each window, in samples
+
+    Returns
+    ----------------------
+     - out: 1D numpy array
+       The BPM in each window (nan if it has no accepted intervals)
+    """
+    valid = accepted[:-1] & accepted[1:]
+    sums = np.concatenate(([0], np.cumsum(np.where(valid, np.diff(peaks), 0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+
+    # Intervals between the peaks first, ..., last - 1 in the window
+    first = np.searchsorted(peaks, windows[:, 0])
+    last = np.maximum(np.searchsorted(peaks, windows[:, 1]) - 1, first)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_interval = (sums[last] - sums[first]) / (counts[last] - counts[first]) / freq * 1000
+    return 60000 / mean_interval
+
+
+def get_ecg_hr(signal, ave_size = 16, parallel=False, workers=None):
     """
     Get a numpy array containing the second by second HR value from the signal, based on averaging
     over the last ave_size seconds.
+
+    With HEARTPY_SEGS the R-peaks are found once, over the whole signal (or in chunks in a pool of
+    processes if parallel, see find_r_peaks_parallel), and the HR of every window is found from them.
     """
     vals = signal.getValues()
     freq = signal.getFrequency()
@@ -26,11 +142,15 @@ def get_ecg_hr(signal, ave_size = 16):
 
     if HEARTPY_SEGS:
         filtered = hp.remove_baseline_wander(hp.scale_data(vals), freq)
+        if parallel:
+            peaks, accepted = find_r_peaks_parallel(filtered, freq, workers)
+        else:
+            peaks, accepted = find_r_peaks(filtered, freq)
+
+        # The windows process_segmentwise would use, a second apart
         overlap = 1 - (1/ave_size)
-        wd, m = hp.process_segmentwise(filtered, sample_rate=freq, segment_width=ave_size, 
-                segment_overlap=overlap, bpmmax=220, mode='fast', 
-                outlier_method='z-score', replace_outliers=False)
-        bpm = np.array(m['bpm'])
+        windows = hp.heartpy.make_windows(filtered, freq, ave_size, overlap, 20)
+        bpm = windowed_bpm(peaks, accepted, freq, windows)
         hr = np.zeros(len(bpm) + ave_size//2)
         hr[(ave_size//2):] = bpm
 
@@ -52,20 +172,220 @@ def get_ecg_hr(signal, ave_size = 16):
 
     return hr
 
+class StreamingRPeakDetector:
+    """
+    Finds the R-peaks of an ECG which is fed to it a chunk at a time, e.g. from
+    a multi-day recording read in blocks, in constant memory.
+
+    The baseline wander is removed by a causal high-pass filter, whose state is
+    carried from one chunk to the next. R-peaks are then the local maxima above
+    a threshold, a fraction of a running average of recent R-peak heights, which
+    are at least 60/bpmmax seconds apart. A peak is only reported once that long
+    after it has been seen, so that much of the ECG is carried into the next chunk.
+    """
+    def __init__(self, freq, cutoff=0.5, bpmmax=220, threshold=0.5, adapt=0.1, warmup=2):
+        """
+        Parameters
+        ------------
+         - freq - sample frequency of the ECG
+         - cutoff - cut-off frequency (Hz) of the baseline removal
+         - bpmmax - highest heart-rate, which sets how close R-peaks can be
+         - threshold - fraction of the R-peak height a peak must be above
+         - adapt - weight of each new R-peak in the running average of their height
+         - warmup - seconds of ECG whose maximum is the first R-peak height
+        """
+        self.freq = freq
+        self.sos = scipy.signal.butter(2, cutoff, btype='highpass', fs=freq, output='sos')
+        self.distance = max(int(freq * 60 / bpmmax), 1)
+        self.threshold = threshold
+        self.adapt = adapt
+        self.warmup = int(warmup * freq)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the filter state, history and R-peak height, to start on a new ECG
+        """
+        self.zi = None
+        self.level = None
+        self.history = np.zeros(0)
+        self.history_start = 0
+        self.confirmed = 0
+        self.last_peak = None
+
+    def _peaks(self, values, limit):
+        """
+        Find the R-peaks in values (the history then the new filtered chunk) up to
+        the index limit, and carry what's needed to find the rest into the next chunk
+        """
+        peaks = np.zeros(0, dtype=int)
+        if self.level is None and values.size >= self.warmup:
+            self.level = np.max(values[:self.warmup])
+
+        if self.level is not None and limit > 0:
+            peaks, properties = scipy.signal.find_peaks(values, 
+                    height=self.threshold * self.level, distance=self.distance)
+            keep = (peaks < limit) & (peaks + self.history_start >= self.confirmed)
+            if self.last_peak is not None:
+                keep &= peaks + self.history_start >= self.last_peak + self.distance
+            heights = properties['peak_heights'][keep]
+            peaks = peaks[keep] + self.history_start
+
+            for height in heights:
+                self.level += self.adapt * (height - self.level)
+            if peaks.size > 0:
+                self.last_peak = peaks[-1]
+
+            # Keep the distance before the limit, so the next peaks are compared with it
+            self.confirmed = self.history_start + limit
+            keep_from = max(limit - self.distance, 0)
+            self.history_start += keep_from
+            values = values[keep_from:]
+
+        self.history = values
+        return peaks
+
+    def process(self, vals):
+        """
+        Find the R-peaks in the next chunk of the ECG
+
+        Parameters
+        ------------
+         - vals - the next chunk of the ECG
+
+        Returns
+        ------------
+         - The times (s) of the R-peaks which could be confirmed, from the start of the ECG
+        """
+        if vals.size == 0:
+            return np.zeros(0)
+        if self.zi is None:
+            self.zi = scipy.signal.sosfilt_zi(self.sos) * vals[0]
+        filtered, self.zi = scipy.signal.sosfilt(self.sos, vals, zi=self.zi)
+
+        values = np.concatenate((self.history, filtered))
+        return self._peaks(values, values.size - self.distance) / self.freq
+
+    def flush(self):
+        """
+        Find the last R-peaks, at the end of the ECG
+
+        Returns
+        ------------
+         - The times (s) of the remaining R-peaks
+        """
+        if self.level is None:
+            self.level = np.max(self.history, initial=0)
+        return self._peaks(self.history, self.history.size) / self.freq
+
+
+def stream_r_peaks(ecgData, block_size=60, start=0, stop=None):
+    """
+    Find the R-peaks of the ECG in an EcgData, e.g. of a multi-day recording, reading
+    it block_size seconds at a time and feeding the blocks to a StreamingRPeakDetector,
+    so only one block is in memory at once.
+
+    Inputs
+    ----------------------
+     - ecgData: ecgdata.EcgData
+       The recording to read the ECG from
+
+     - start, stop: int
+       The samples of the ECG channel to read between, e.g. from
+       Sync.getSyncedECGRange. stop is the end of the channel if None.
+
+    Returns
+    ----------------------
+     - out: generator
+       Arrays of the times (s) of R-peaks, from start, as they are found
+    """
+    freq = ecgData.getFrequency("ECG")
+    if stop is None:
+        stop = ecgData.getLength("ECG")
+    detector = StreamingRPeakDetector(freq)
+
+    block = int(block_size * freq)
+    for first in range(start, stop, block):
+        # getECG takes seconds, so ask for half a sample more, which it rounds down
+        size = min(block, stop - first)
+        ecg = ecgData.getECG((first + 0.5) / freq, (size + 0.5) / freq)
+        yield detector.process(ecg.getValues())
+    yield detector.flush()
+
+
+def reject_r_peaks_running(peaks, freq, count=RR_RUNNING_COUNT):
+    """
+    Reject R-peaks as reject_r_peaks, but comparing each interval with the mean of
+    the count intervals before it, rather than of them all, so the rejection follows
+    the heart-rate over a long recording and can be done as the peaks are found.
+    The first interval is always accepted.
+
+    Returns
+    ----------------------
+     - accepted: 1D numpy array
+       Whether each peak was accepted
+    """
+    intervals = (np.diff(peaks) / freq) * 1000.0
+    sums = np.concatenate(([0], np.cumsum(intervals)))
+    ends = np.arange(intervals.size)
+    starts = np.maximum(ends - count, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_interval = (sums[ends] - sums[starts]) / (ends - starts)
+    mean_interval[:1] = intervals[:1]
+    margin = np.maximum(0.3 * mean_interval, 300)
+
+    accepted = np.ones(peaks.size, dtype=bool)
+    accepted[1:] = (intervals > mean_interval - margin) & (intervals < mean_interval + margin)
+    return accepted
+
+
+def get_streamed_ecg_hr(synced, ave_size = 16, block_size=60):
+    """
+    Get a numpy array containing the second by second HR value from the synced ECG, as
+    get_ecg_hr, but with the R-peaks found by stream_r_peaks, straight from the
+    recording in blocks of block_size seconds. Peaks after an outlying interval are
+    rejected with reject_r_peaks_running.
+
+    Inputs
+    ----------------------
+     - synced: sync.Sync
+       The synced recordings, whose ECG is read between getSyncedECGRange
+    """
+    ecgData = synced.ecgData
+    freq = ecgData.getFrequency("ECG")
+    start, stop = synced.getSyncedECGRange()
+    times = np.concatenate(list(stream_r_peaks(ecgData, block_size, start, stop)))
+    peaks = np.round(times * freq).astype(int)
+
+    # The windows process_segmentwise would use, a second apart. make_windows only
+    # needs the length of the ECG, so it isn't read.
+    overlap = 1 - (1/ave_size)
+    windows = hp.heartpy.make_windows(range(stop - start), freq, ave_size, overlap, 20)
+    bpm = windowed_bpm(peaks, reject_r_peaks_running(peaks, freq), freq, windows)
+    hr = np.zeros(len(bpm) + ave_size//2)
+    hr[(ave_size//2):] = bpm
+    return hr
+
 def get_ppg_hr(signal, ave_size = 30, method = 'sd'):
+    """
+    Get a numpy array containing the second by second HR value from the PPG signal, based on
+    the last ave_size seconds.
+    """
     vals = signal.getValues()
     freq = signal.getFrequency()
     length = int(vals.size / freq)
     hr = np.zeros(length)
 
-    for i in range(ave_size, length - 1, 1):
-        window = vals[int(freq * (i - ave_size)) : int(freq * i)]
-        if method == 'sd':
-            hr[i] = peakfind.get_rate_min_sd(data.getSignal(window, freq))
-        elif method == 'naive':
-            hr[i] = peakfind.get_rate_naive(data.getSignal(window, freq))
-        else:
-            raise ValueError("Invalid argument for method, valid arguments are 'sd' or 'naive'")
+    seconds = np.arange(ave_size, length - 1)
+    windows = np.stack(((freq * (seconds - ave_size)).astype(int), (freq * seconds).astype(int)), axis=1)
+    if method == 'sd':
+        # The windows overlap by all but a second, so share the search between them
+        hr[seconds] = peakfind.sliding_rates_min_sd(signal, windows)
+    elif method == 'naive':
+        for i, (start, stop) in zip(seconds, windows):
+            hr[i] = peakfind.get_rate_naive(data.getSignal(vals[start:stop], freq))
+    else:
+        raise ValueError("Invalid argument for method, valid arguments are 'sd' or 'naive'")
 
     
     for i in range(ave_size):
@@ -108,12 +428,10 @@ if False and __name__ == "__main__":
     accelerationY = synced.getSyncedAcceleration('y')
     accelerationZ = synced.getSyncedAcceleration('z')
 
-    accelerationX = filtering.butter_bandpass_filter(
-            accelerationX, lowerBPM/60, upperBPM/60).normalize()
-    accelerationY = filtering.butter_bandpass_filter(
-            accelerationY, lowerBPM/60, upperBPM/60).normalize()
-    accelerationZ = filtering.butter_bandpass_filter(
-            accelerationZ, lowerBPM/60, upperBPM/60).normalize()
+    acceleration = data.getMultiSignal([accelerationX, accelerationY, accelerationZ])
+    acceleration = filtering.butter_bandpass_filter(acceleration, lowerBPM/60, upperBPM/60)
+    accelerationX, accelerationY, accelerationZ = [axis.normalize() 
+            for axis in acceleration.getChannels()]
 
     # Run adaptive motion filters on each axis to remove motion from signals
     ppgMotionFiltered = motionfilter.adaptiveFilter(
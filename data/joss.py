@@ -1,14 +1,23 @@
+import concurrent.futures
+import functools
+import itertools
 import scipy
+import scipy.linalg
+import scipy.signal
 import numpy as np
 import matplotlib.pyplot as plt
 import sys
 import heartrate
 import filtering
+import data
 from sync import Sync
 import heartpy as hp
-import matlab.engine
 
-DEBUG = True
+DEBUG = False
+
+# M-FOCUSS parameters, see mfocuss
+MFOCUSS_LAMBDA = 1e-10
+MFOCUSS_MAX_ITERS = 4
 
 def get_ecg_bpm(ecg, start, window_size = 8, shift=2):
     freq = ecg.frequency
@@ -19,7 +28,8 @@ def get_ecg_bpm(ecg, start, window_size = 8, shift=2):
     return m['bpm']
 
 
-def joss(sync, freq = 20, window_size = 8, shift = 4, errors=False):
+def joss(sync, freq = 20, window_size = 8, shift = 4, errors=False, 
+        lam=MFOCUSS_LAMBDA, max_iters=MFOCUSS_MAX_ITERS, parallel=False, workers=None):
     """
     Run the JOSS algorithm to calculate heart-rate.
 
@@ -29,6 +39,13 @@ def joss(sync, freq = 20, window_size = 8, shift = 4, errors=False):
 
      - errors : should errors be returned
 
+     - lam, max_iters : regularisation and number of iterations of M-FOCUSS
+
+     - parallel : compute the spectra of all windows up front, in a pool of
+                  processes, then run the (sequential) peak tracking over them
+
+     - workers : number of processes to use when parallel, None for one per core
+
     Returns
     ------------
      - hr : the estimated heart-rate, an array, with each heart-rate
@@ -37,41 +54,47 @@ def joss(sync, freq = 20, window_size = 8, shift = 4, errors=False):
 
     freq = 20
 
-    ppg = sync.getSyncedPPG().resample(freq)
-    accel_x = sync.getSyncedAcceleration('x').resample(freq)[:ppg.size]
-    accel_y = sync.getSyncedAcceleration('y').resample(freq)[:ppg.size]
-    accel_z = sync.getSyncedAcceleration('z').resample(freq)[:ppg.size]
+    ppg = sync.getSyncedPPG().resample(freq, "polyphase")
+    accel_x = sync.getSyncedAcceleration('x').resample(freq, "polyphase")[:ppg.size]
+    accel_y = sync.getSyncedAcceleration('y').resample(freq, "polyphase")[:ppg.size]
+    accel_z = sync.getSyncedAcceleration('z').resample(freq, "polyphase")[:ppg.size]
     ecg = sync.getSyncedECG()
 
     
-    ppg = filtering.butter_bandpass_filter(ppg, 0.4, 4, 4)
-    accel_x = filtering.butter_bandpass_filter(accel_x, 0.4, 4, 4)
-    accel_y = filtering.butter_bandpass_filter(accel_y, 0.4, 4, 4)
-    accel_z = filtering.butter_bandpass_filter(accel_z, 0.4, 4, 4)
-
-    hr = []
-
-    eng = matlab.engine.start_matlab()
-
-    loc = 121
-    bpm = 121
-    trap_count = 0
+    channels = data.getMultiSignal([ppg, accel_x, accel_y, accel_z])
+    channels = filtering.butter_bandpass_filter(channels, 0.4, 4, 4)
+    ppg, accel_x, accel_y, accel_z = channels.getChannels()
 
-    if errors:
-        error_list = []
-
-
-    # Iterate through windows
+    # Find the windows, and the normalised signals in each of them
+    starts = []
     start = 0
     while (start + window_size) * freq < ppg.size:
-        window = np.arange(start * freq, (start+window_size) * freq, 1)
+        starts.append(start)
+        start += shift
+
+    def window_signals(signal):
+        for start in starts:
+            window = np.arange(start * freq, (start+window_size) * freq, 1)
+            yield signal[window].normalize()
+
+    args = (window_signals(ppg), window_signals(accel_x), window_signals(accel_y), 
+            window_signals(accel_z), itertools.repeat(lam), itertools.repeat(max_iters))
+
+    # The spectra of windows are independent of each other, so can be computed in parallel,
+    # then cleaned all at once. Otherwise they're computed lazily as each window is tracked.
+    if parallel:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            spectra = np.array(list(executor.map(window_ssr, *args, chunksize=4)))
+        spectra = zip(*clean_spectra(spectra))
+    else:
+        spectra = map(joss_ssr, *args)
 
-        spectrum, accel_max = joss_ssr(ppg[window].normalize(), accel_x[window].normalize(), 
-                accel_y[window].normalize(), accel_z[window].normalize(), eng)
+    spectra = (spectrum for spectrum, accel_max in spectra)
 
-        if DEBUG:
-            print("At start={}, loc={} bpm={} trap_count={} spectrum_shape={}".format(start, 
-                loc, bpm, trap_count, spectrum.shape))
+    def show_spectra(spectra):
+        # Plot each window's spectrum, with the ECG's heart-rate, before it's tracked
+        for start, spectrum in zip(starts, spectra):
+            print("At start={}, spectrum_shape={}".format(start, spectrum.shape))
             ecg_bpm = get_ecg_bpm(ecg, start, window_size)
             print("ECG bpm = {}".format(ecg_bpm))
             plt.subplot(224)
@@ -79,38 +102,89 @@ def joss(sync, freq = 20, window_size = 8, shift = 4, errors=False):
             plt.title("PPG")
             plt.gca().axvline(x=ecg_bpm, color='r')
             plt.show()
+            yield spectrum
 
-        loc, bpm, trap_count = joss_spt(spectrum, freq, loc, bpm, trap_count)
+    if DEBUG:
+        spectra = show_spectra(spectra)
 
+    hr = joss_track(spectra, freq)
 
-        if errors:
+    if errors:
+        error_list = []
+        for start, bpm in zip(starts, hr):
             try:
                 ecg_bpm = get_ecg_bpm(ecg, start, window_size)
                 error = bpm - ecg_bpm
                 error_list.append(error)
             except:
                 print("Error with HR calculation")
-                
+        return error_list
 
-                
+    return hr
 
 
-        hr.append(bpm)
 
-        start += shift 
 
-    eng.quit()
 
-    if errors:
-        return error_list
+def window_ssr(ppg, accel_x, accel_y, accel_z, lam=MFOCUSS_LAMBDA, 
+        max_iters=MFOCUSS_MAX_ITERS):
+    """
+    Run sparse spectrum reconstruction on the MMV model of one window, without
+    cleaning the spectra (see clean_spectra).
 
-    return np.array(hr)
+    Returns
+    ----------------
+     - spectra : (N, 4) array with the ppg, x, y and z spectra as columns
+    """
+    freq = ppg.frequency
+
+    N = 60 * freq # Resolution is 1 BPM
+
+    Y = np.array((ppg.values, accel_x.values, accel_y.values, 
+            accel_z.values))
+
+    Y = np.transpose(Y)
 
+    return ssr(Y, freq, N, lam, max_iters)
 
 
+def clean_spectra(spectra, aggression=0.99):
+    """
+    Clean the SSR spectra of one or many windows at once.
+
+    Each spectrum is limited to 20-220 BPM and normalised, then the maximum of
+    the acceleration spectra in each bin is subtracted from the ppg spectrum,
+    and bins below a quarter of the remaining maximum are zeroed.
 
+    Inputs
+    -----------------
+     - spectra : (..., N, 4) array, the ppg, x, y and z spectra as columns,
+                 e.g. (windows, N, 4) to clean a whole recording in one call.
+                 It is normalised in place.
+     - aggression : fraction of the acceleration spectra to subtract
 
-def joss_ssr(ppg, accel_x, accel_y, accel_z, eng):
+    Returns
+    ----------------
+     - signal_ssr : (..., N) array, the cleaned ppg spectra
+     - accel_max : (..., N) array, the maximum acceleration in each bin
+    """
+    spectra[..., :20, :] = 0
+    spectra[..., 220:, :] = 0
+    spectra /= np.max(spectra, axis=-2, keepdims=True)
+
+    # Modify the SSR signal by subtracting the maximum acceleration in each bin
+    accel_max = np.max(spectra[..., 1:], axis=-1)
+    signal_ssr = spectra[..., 0] - aggression * accel_max
+
+    # Set all SSR bins lower than the maximum divided by 4 to 0
+    max_bin = np.max(signal_ssr, axis=-1, keepdims=True)
+    signal_ssr[signal_ssr < max_bin / 4] = 0
+
+    return signal_ssr, accel_max
+
+
+def joss_ssr(ppg, accel_x, accel_y, accel_z, lam=MFOCUSS_LAMBDA, 
+        max_iters=MFOCUSS_MAX_ITERS):
     """
     Run sparse spectrum reconstruction on the MMV model.
 
@@ -120,49 +194,16 @@ def joss_ssr(ppg, accel_x, accel_y, accel_z, eng):
      - accel_x : x acceleration as signal
      - accel_y : y acceleration as signal
      - accel_z : z acceleration as signal
+     - lam, max_iters : regularisation and number of iterations of M-FOCUSS
 
      Returns
      ----------------
       - ssr_spectrum : the cleaned sparse spectrum of the ppg
 
     """
+    spectra = window_ssr(ppg, accel_x, accel_y, accel_z, lam, max_iters)
 
-    freq = ppg.frequency
-
-    N = 60 * freq # Resolution is 1 BPM
-
-    Y = np.array((ppg.values, accel_x.values, accel_y.values, 
-            accel_z.values))
-
-    Y = np.transpose(Y)
-
-    L = Y.shape[1]
-
-    spectra = ssr(Y, freq, N, eng)
-    
-    for i in range(0, L):
-        spectra_i = spectra[:,i]
-
-        spectra_i[:20] = 0
-        spectra_i[220:] = 0
-
-        spectra_i = spectra_i / np.max(spectra_i)
-        spectra[:,i] = spectra_i
-
-
-    # BPM axis
-    bpm = 60 * freq / N * np.arange(N)
-
-    aggression = 0.99
-    accel_max = np.zeros((N))
-    signal_ssr = spectra[:,0]
-
-    # Modify the SSR signal by subtracting the maximum acceleration in each bin
-    for i in range(0, bpm.size):
-        # Max of acceleration at this frequency
-        accel_max[i] = np.max([spectra[i,1], spectra[i,2], spectra[i,3]])
-
-        signal_ssr[i] = signal_ssr[i] - aggression * accel_max[i]
+    signal_ssr, accel_max = clean_spectra(spectra)
 
     if DEBUG:
         plt.subplot(221)
@@ -175,35 +216,152 @@ def joss_ssr(ppg, accel_x, accel_y, accel_z, eng):
         plt.title("z")
         plt.plot(spectra[:,3])
 
-
-    # Set all SSR bins lower than the maximum divided by 5 to 0
-    max_bin = np.max(signal_ssr)
-    signal_ssr[signal_ssr < max_bin / 4] = 0
-
     return signal_ssr, accel_max
     
 
-def ssr(y, freq, N, eng):
+def ssr(y, freq, N, lam=MFOCUSS_LAMBDA, max_iters=MFOCUSS_MAX_ITERS):
     M = np.max(y.shape)
 
-    # Make the Fourier matrix
-    phi = np.zeros((M, N), dtype=complex)
-    complex_factor = 1j * 2 * np.pi / N
-    for m in range(0, M):
-        for n in range(0, N):
-            phi[m,n] = np.exp(complex_factor * m * n)
-
-    Phi = matlab.double(phi.tolist(), is_complex=True)
-    Y = matlab.double(y.tolist())
+    phi = fourier_dictionary(M, N)
 
-    X = eng.MFOCUSS(Phi, Y, 1e-10, 'MAX_ITERS', 4)
-    x = np.array(X)
+    x = mfocuss(phi, y, lam, max_iters, fourier=True)
     x = np.abs(x) ** 2
 
     
     return x
 
+
+@functools.lru_cache(maxsize=8)
+def fourier_dictionary(M, N):
+    """
+    Return the (M, N) Fourier matrix phi[m, n] = exp(2 pi i m n / N).
+
+    The matrix only depends on the window length and resolution, so it is
+    built once and shared between windows and recordings. It is read-only.
+    """
+    # Reduce m n modulo N first, so the phases (and hence exp) stay accurate
+    phase = np.outer(np.arange(M), np.arange(N)) % N
+    phi = np.exp(1j * 2 * np.pi / N * phase)
+    phi.setflags(write=False)
+    return phi
+
+
+def mfocuss(phi, y, lam, max_iters=800, p=0.8, prune_gamma=1e-4, epsilon=1e-8, 
+        fourier=False):
+    """
+    Solve the multiple measurement vector model y = phi x + v for a row sparse
+    x, using M-FOCUSS (Cotter, Rao, Engan and Kreutz-Delgado, 2005).
+
+    Parameters
+    ----------
+     - phi : (M, N) dictionary matrix
+     - y : (M, L) measurements, one column per signal
+     - lam : regularisation, trading off sparsity against fitting y (as in
+       the MATLAB MFOCUSS, small values such as 1e-10 suit low noise)
+     - max_iters : maximum number of reweighting iterations
+     - p : the diversity measure used is the l_(2,p) norm of x
+     - prune_gamma : rows whose weight drops below this are removed
+     - epsilon : stop once x changes by less than this between iterations
+     - fourier : phi is fourier_dictionary(M, N) with M <= N. Its rows are
+       orthogonal, so the first iteration is done with an FFT instead of an SVD
+
+    Returns
+    ----------
+     - x : (N, L) solution, zero in the rows that were pruned
+    """
+    N = phi.shape[1]
+    L = y.shape[1]
+
+    gamma = np.ones(N)
+    keep = np.arange(N)
+    mu = None
+
+    for count in range(max_iters):
+        if count == 0 and fourier:
+            # All weights are 1, so G = phi, whose singular values are all sqrt(N),
+            # and mu = phi^H y / (N + sqrt(lam)), where phi^H y is the N point FFT of y
+            mu = np.fft.fft(y, n=N, axis=0) / (N + np.sqrt(lam) + 1e-16)
+            gamma = (np.sum(np.abs(mu) ** 2, axis=1) / L) ** (1 - p / 2)
+            continue
+
+        # Prune rows which have gone to zero
+        index = gamma > prune_gamma
+        gamma = gamma[index]
+        phi = phi[:, index]
+        keep = keep[index]
+
+        # Weighted, regularised minimum norm solution mu = W G^H (G G^H + sqrt(lam) I)^-1 y,
+        # where G = phi W, calculated from the SVD of G. As in the MATLAB MFOCUSS
+        # lam enters as its square root, which keeps tiny singular values in check.
+        weights = np.sqrt(gamma)
+        G = phi * weights
+        U, S, Vh = scipy.linalg.svd(G, full_matrices=False)
+        Xi = (Vh.conj().T * (S / (S ** 2 + np.sqrt(lam) + 1e-16))) @ U.conj().T
+        mu_old = mu
+        mu = weights[:, np.newaxis] * (Xi @ y)
+
+        # Update the weights from the row norms of the solution
+        mu2_bar = np.sum(np.abs(mu) ** 2, axis=1)
+        gamma = (mu2_bar / L) ** (1 - p / 2)
+
+        if mu_old is not None and mu_old.shape == mu.shape:
+            if np.max(np.abs(mu_old - mu)) < epsilon:
+                break
+
+    x = np.zeros((N, L), dtype=mu.dtype)
+    x[keep, :] = mu
+    return x
+
     
+def find_peaks_in(spectrum, start, stop):
+    """
+    Find the peaks of spectrum within bins [start, stop), treating the bins
+    outside the range as 0 (as if the spectrum had been masked to the range),
+    while only looking at the bins in the range.
+
+    Returns
+    ----------
+     - locs : the bins of the peaks found
+    """
+    N = spectrum.size
+    start = max(start, 1)
+    stop = min(stop, N)
+    if start >= stop:
+        return np.array([], dtype=int)
+
+    # Pad with the zero bins either side of the range. The last bin of the
+    # spectrum has no right neighbour, so is never a peak, and isn't padded.
+    padded = np.zeros(stop - start + 2)
+    padded[1:stop - start + 1] = spectrum.ravel()[start:stop]
+    if stop == N:
+        padded = padded[:-1]
+
+    locs, _ = scipy.signal.find_peaks(padded)
+    return locs - 1 + start
+
+
+def joss_track(spectra, freq, loc=121, bpm=121, trap_count=0):
+    """
+    Run spectral peak tracking over the spectra of consecutive windows.
+
+    Parameters
+    ----------
+     - spectra : cleaned spectra of the windows in order, e.g. a (windows, N) array
+                 from clean_spectra, or an iterable computing them as they're needed
+     - freq : sampling frequency
+     - loc, bpm, trap_count : the tracking state to start from
+
+    Returns
+    ----------
+     - hr : the heart-rate (bpm) tracked in each window
+    """
+    hr = []
+    for spectrum in spectra:
+        loc, bpm, trap_count = joss_spt(spectrum, freq, loc, bpm, trap_count)
+        hr.append(bpm)
+    return np.array(hr)
+
+
 def joss_spt(spectrum, freq, prev_loc, prev_bpm, trap_count):
     """
     Run spectral peak tracking
@@ -234,14 +392,9 @@ def joss_spt(spectrum, freq, prev_loc, prev_bpm, trap_count):
 
     else:
         for delta in deltas:
-            rng = np.arange(prev_loc - delta, prev_loc + delta)
-
             # find peaks in range
-            mask = np.zeros((N,))
-            mask[rng[rng>0]] = 1
-            filtered = (spectrum * mask).flatten()
-            locs, _ = scipy.signal.find_peaks(filtered)
-            vals = filtered[locs]
+            locs = find_peaks_in(spectrum, prev_loc - delta, prev_loc + delta)
+            vals = spectrum[locs]
 
             num_peaks = locs.size
             if num_peaks > 0:
@@ -273,14 +426,8 @@ def joss_spt(spectrum, freq, prev_loc, prev_bpm, trap_count):
 
 
 def discover_peak(spectrum, prev_loc):
-    rng = np.arange(40, 220)
-    N = spectrum.shape[0]
-
     # find peaks in range
-    mask = np.zeros((N,))
-    mask[rng] = 1
-    filtered = (spectrum * mask).flatten()
-    locs, _ = scipy.signal.find_peaks(filtered)
+    locs = find_peaks_in(spectrum, 40, 220)
 
     if locs.size == 0:
         return prev_loc
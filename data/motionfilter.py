@@ -1,11 +1,208 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import adaptfilt as adf
 import sys
 import sync
 import filtering
 import data
 from scipy import signal
+from scipy.linalg import blas
+from numpy.lib.stride_tricks import sliding_window_view
+
+# numba is optional, if it is installed the adaptive filter loop is compiled
+try:
+  import numba
+except ImportError:
+  numba = None
+
+# Added to the tap energy before normalising, so silent inputs don't divide by 0
+NLMS_EPSILON = 0.001
+
+
+def _tap_matrix(reference, K):
+  """
+  Return a (N-K, K) read-only view of reference whose n-th row is
+  reference[n+K], reference[n+K-1], ..., reference[n+1], i.e. the taps seen by
+  the filter when it predicts sample n+K. No data is copied.
+  """
+  return sliding_window_view(reference[1:], K)[:, ::-1]
+
+
+def _adaptive_loop(d, taps, norms, step, e, w):
+  """
+  Run the (N)LMS weight updates, writing the error for each sample into e.
+
+  taps is a list of tap matrices (one per reference channel), norms the
+  normalisation applied at each sample (1 for plain LMS) and w the (channels, K)
+  weights to start from. The weights are updated in place with BLAS axpy, so
+  nothing is allocated per sample.
+  """
+  weights = list(w)
+  for n in range(d.size):
+    e_n = d[n]
+    for tap, w in zip(taps, weights):
+      e_n -= np.dot(tap[n], w)
+
+    factor = step * e_n / norms[n]
+    for tap, w in zip(taps, weights):
+      blas.daxpy(tap[n], w, a=factor)
+
+    e[n] = e_n
+
+
+def _adaptive_loop_compiled(d, references, norms, step, e, w):
+  """
+  Same as _adaptive_loop, on a (channels, N) array of references, written with
+  scalar loops for numba to compile.
+  """
+  C, K = w.shape
+  for n in range(d.size):
+    e_n = d[n]
+    for c in range(C):
+      for k in range(K):
+        e_n -= references[c, n + K - k] * w[c, k]
+
+    factor = step * e_n / norms[n]
+    for c in range(C):
+      for k in range(K):
+        w[c, k] += factor * references[c, n + K - k]
+
+    e[n] = e_n
+
+
+if numba is not None:
+  _adaptive_loop_compiled = numba.njit(cache=True)(_adaptive_loop_compiled)
+
+
+def _run_adaptive(d, references, step, normalised, e, w):
+  """
+  Filter d against the (channels, d.size + K) references, starting from and
+  updating the (channels, K) weights w, and write the error into e.
+  """
+  K = w.shape[1]
+  taps = [_tap_matrix(reference, K) for reference in references]
+  if normalised:
+    norms = sum(np.einsum('ij,ij->i', tap, tap) for tap in taps) + NLMS_EPSILON
+  else:
+    norms = np.ones(d.size)
+
+  if numba is not None:
+    _adaptive_loop_compiled(d, references, norms, float(step), e, w)
+  else:
+    _adaptive_loop(d, taps, norms, step, e, w)
+
+
+def adaptive_filter(ppg, references, K=15, step=1, normalised=True):
+  """
+  Run an (N)LMS adaptive filter over numpy arrays, using taps from every
+  reference channel jointly.
+
+  Parameters
+  ------------
+   - ppg - 1D array, the signal we want to remove noise from
+   - references - 2D array (channels, N) of signals correlated with the noise,
+     each at least as long as ppg
+   - K - number of taps to use per reference channel
+   - step - step size to use
+   - normalised - True for NLMS, False for LMS
+
+  Returns
+  ------------
+   - e - the error signal (the ppg with noise removed), of size N-K
+  """
+  N = ppg.size
+  references = np.ascontiguousarray(np.atleast_2d(references)[:, :N], dtype=np.float64)
+  d = np.ascontiguousarray(ppg[K:], dtype=np.float64)
+  e = np.empty(N-K)
+  w = np.zeros((references.shape[0], K))
+
+  _run_adaptive(d, references, step, normalised, e, w)
+
+  return e
+
+
+class StreamingFilter:
+  """
+  An (N)LMS adaptive filter which is fed the PPG and reference signals a chunk
+  at a time, e.g. as they arrive from the watch. The weights and the last K
+  reference samples are carried from one chunk to the next, so the output is
+  exactly what adaptive_filter would give on the whole signal, with no seams
+  at chunk boundaries, while only ever holding one chunk in memory.
+
+  As with adaptive_filter, the first K samples of the stream produce no output.
+  """
+  def __init__(self, K=20, step=1, channels=1, normalised=True):
+    """
+    Parameters
+    ------------
+     - K - number of taps to use per reference channel
+     - step - step size to use
+     - channels - number of reference signals (e.g. 3 for x, y and z)
+     - normalised - True for NLMS, False for LMS
+    """
+    self.K = K
+    self.step = step
+    self.normalised = normalised
+    self.weights = np.zeros((channels, K))
+    self.history = np.zeros((channels, 0))
+
+  def reset(self):
+    """
+    Forget the weights and history, to start filtering a new stream
+    """
+    self.weights[:] = 0
+    self.history = np.zeros((self.weights.shape[0], 0))
+
+  def output_size(self, chunk_size):
+    """
+    Number of output samples the next chunk of chunk_size samples will produce
+    """
+    return max(self.history.shape[1] + chunk_size - self.K, 0)
+
+  def process(self, ppg, references, out=None):
+    """
+    Filter the next chunk.
+
+    Parameters
+    ------------
+     - ppg - 1D array, the next chunk of the signal to remove noise from
+     - references - (channels, L) array with the matching chunk of each
+       reference signal (a 1D array is fine for a single channel)
+     - out - optional preallocated array of at least output_size(L) samples to
+       write the output into
+
+    Returns
+    ------------
+     - e - the filtered chunk, a view of out if it was given
+    """
+    references = np.atleast_2d(references)
+    if references.shape[1] != ppg.size:
+      raise ValueError("PPG and reference chunks must be the same length")
+
+    size = self.output_size(ppg.size)
+    if out is None:
+      out = np.empty(size)
+    elif out.size < size:
+      raise ValueError("Output buffer is too small, need {} samples".format(size))
+    e = out[:size]
+
+    extended = np.ascontiguousarray(
+        np.concatenate((self.history, references), axis=1), dtype=np.float64)
+    if size > 0:
+      d = np.ascontiguousarray(ppg[ppg.size - size:], dtype=np.float64)
+      _run_adaptive(d, extended, self.step, self.normalised, e, self.weights)
+
+    self.history = extended[:, -self.K:]
+    return e
+
+
+def _reference_values(accel, freq, N):
+  """
+  Resample a reference signal, or list of them, to freq and return them as a
+  (channels, N) array
+  """
+  if isinstance(accel, data.Signal):
+    accel = [accel]
+  return np.array([a.resample(freq).crop(N).getValues() for a in accel])
 
 
 def nlms_filter(ppg, accel, K=15, step=1):
@@ -16,8 +213,9 @@ def nlms_filter(ppg, accel, K=15, step=1):
   Parameters
   ------------
    - ppg - the signal we want to remove noise from
-   - accel - a signal we think is correlated with the noise
-   - K - number of taps to use in the filter
+   - accel - a signal we think is correlated with the noise, or a list of them
+     (e.g. all three accelerometer axes) to filter against jointly
+   - K - number of taps to use in the filter (per signal in accel)
    - step - step size to use
 
   Returns
@@ -29,23 +227,9 @@ def nlms_filter(ppg, accel, K=15, step=1):
 
   # Preprocessing
   freq = ppg.getFrequency()
-  accel = accel.resample(freq)
-  accel = accel.crop(N)
+  accel = _reference_values(accel, freq, N)
 
-  accel = accel.getValues()
-  ppg = ppg.getValues()
-
-  w = np.zeros(K)      # Initial filter
-  e = np.zeros(N-K)    # Initial error
-
-  for n in range(0, N-K):
-    accel_n = accel[n+K:n:-1]
-    e_n = ppg[n+K] - np.dot(accel_n, w)          
-
-    norm_factor = 1 / (np.dot(accel_n, accel_n) + 0.001)
-    w = w + step * e_n * accel_n * norm_factor
-
-    e[n] = e_n
+  e = adaptive_filter(ppg.getValues(), accel, K, step, normalised=True)
 
   return data.getSignal(e, freq)
 
@@ -57,8 +241,9 @@ def lms_filter(ppg, accel, K=15, step=1):
   Parameters
   ------------
    - ppg - the signal we want to remove noise from
-   - accel - a signal we think is correlated with the noise
-   - K - number of taps to use in the filter
+   - accel - a signal we think is correlated with the noise, or a list of them
+     to filter against jointly
+   - K - number of taps to use in the filter (per signal in accel)
    - step - step size to use
 
   Returns
@@ -70,23 +255,11 @@ def lms_filter(ppg, accel, K=15, step=1):
 
   # Preprocessing
   freq = ppg.getFrequency()
-  accel = accel.resample(freq)
-  accel = accel.crop(N)
-
-  accel = accel.getValues()
-  ppg = ppg.getValues()
+  accel = _reference_values(accel, freq, N)
 
-  w = np.zeros(K)      # Initial filter
-  e = np.zeros(N-K)    # Initial error
+  e = adaptive_filter(ppg.getValues(), accel, K, step, normalised=False)
 
-  for n in range(0, N-K):
-    accel_n = accel[n+K:n:-1]
-    e_n = ppg[n+K] - np.dot(accel_n, w)          
-    w = w + step * e_n * accel_n
-
-    e[n] = e_n
-
-  return data.getSignal(e_n, freq)
+  return data.getSignal(e, freq)
 
 
 
@@ -123,13 +296,17 @@ def lms_filter(ppg, accel, K=15, step=1):
 
 """
 Use an adaptive filter to remove noise caused by (and hence correlating
-with) referenceMotion, from signal.
+with) referenceMotion, from signal. referenceMotion may be a list of signals
+(e.g. all three accelerometer axes), which are then filtered against jointly
+in a single pass.
 """
 def adaptiveFilter(signal, referenceMotion, step=1, nlms=True, M = 20):
     # Sample referenceMotion at signal's frequency
     freq = signal.getFrequency()
-    referenceMotion = referenceMotion.resample(freq)
-    referenceMotion = referenceMotion.crop(signal.size)
+    if isinstance(referenceMotion, data.Signal):
+        referenceMotion = referenceMotion.resample(freq).crop(signal.size)
+    else:
+        referenceMotion = [r.resample(freq).crop(signal.size) for r in referenceMotion]
 
 
 
@@ -142,6 +319,11 @@ def adaptiveFilter(signal, referenceMotion, step=1, nlms=True, M = 20):
 
 
 
+"""
+Run an NLMS adaptive filter over signal windowSize samples at a time, carrying
+the filter state between windows (see StreamingFilter) and writing into a
+single preallocated output.
+"""
 def adaptiveFilterWindowed(signal, referenceMotion, windowSize = 1000):
     # Sample referenceMotion at signal's frequency
     freq = signal.getFrequency()
@@ -153,14 +335,14 @@ def adaptiveFilterWindowed(signal, referenceMotion, windowSize = 1000):
 
     M = 20 # Num of filter taps
     step = 1 # Step size
-    output = np.array([])
+    stream = StreamingFilter(K=M, step=step)
+    output = np.empty(max(ppgVals.size - M, 0))
 
-    while ppgVals.size > 0:
-        y, e, w = adf.nlms(accelVals[:windowSize], ppgVals[:windowSize],
-                M, step, returnCoeffs=True)
-        output = np.concatenate((output, e))
-        accelVals = accelVals[windowSize:]
-        ppgVals = ppgVals[windowSize:]
+    written = 0
+    for start in range(0, ppgVals.size, windowSize):
+        window = slice(start, start + windowSize)
+        e = stream.process(ppgVals[window], accelVals[window], out=output[written:])
+        written += e.size
 
     filtered = data.getSignal(output, freq)
     return filtered
@@ -187,12 +369,10 @@ if __name__ == "__main__":
     accelerationY = synced.getSyncedAcceleration('y')
     accelerationZ = synced.getSyncedAcceleration('z')
 
-    accelerationX = filtering.butter_bandpass_filter(
-	    accelerationX, lowerBPM/60, upperBPM/60).normalize()
-    accelerationY = filtering.butter_bandpass_filter(
-	    accelerationY, lowerBPM/60, upperBPM/60).normalize()
-    accelerationZ = filtering.butter_bandpass_filter(
-            accelerationZ, lowerBPM/60, upperBPM/60).normalize()
+    acceleration = data.getMultiSignal([accelerationX, accelerationY, accelerationZ])
+    acceleration = filtering.butter_bandpass_filter(acceleration, lowerBPM/60, upperBPM/60)
+    accelerationX, accelerationY, accelerationZ = [axis.normalize() 
+            for axis in acceleration.getChannels()]
 
     motionFiltered = butterFiltered
 
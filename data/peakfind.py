@@ -6,6 +6,19 @@ import sync
 import filtering
 import data
 
+# Percentages above the moving average tried as thresholds by the min-SD peak finder
+MIN_SD_PERCS = [0, 5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 150, 200, 300]
+
+# moving_mean restarts its running sums every this many means
+MOVING_MEAN_BLOCK = 4096
+
+# Values within this fraction of the signal's largest value of a min-SD threshold are
+# compared with the threshold from the exact moving average instead
+MEAN_TIE_TOLERANCE = 1e-9
+
+# sliding_rates_min_sd looks at the ends of this many windows at once
+SLIDING_WINDOW_BLOCK = 256
+
 def find_peaks(signal):
     """
     Find peaks using the naive local maxima solution
@@ -28,6 +41,113 @@ def find_peaks(signal):
 
 
 
+def moving_mean(values, width, out=None):
+    """
+    Mean of every width consecutive values, as np.convolve with a flat kernel
+    in 'valid' mode, from running sums so it's O(N) whatever the width. The
+    sums are restarted every MOVING_MEAN_BLOCK means, so rounding errors don't
+    build up along long signals, but the means can still differ from
+    np.convolve's in the last bits (see exact_means).
+
+    Inputs
+    ----------------------
+     - values: 1D numpy array
+       The values to average
+
+     - width: int
+       Number of values in each mean
+
+     - out: 1D numpy array, optional
+       Array of size values.size - width + 1 to write the means into
+
+    Returns
+    ---------------------
+     - out: 1D numpy array
+       The means, of size values.size - width + 1
+    """
+    size = values.size - width + 1
+    if out is None:
+        out = np.empty(max(size, 0))
+    if size <= 0:
+        return out
+
+    sums = np.empty(min(size, MOVING_MEAN_BLOCK) + width)
+    for start in range(0, size, MOVING_MEAN_BLOCK):
+        stop = min(start + MOVING_MEAN_BLOCK, size)
+        block = values[start:stop + width - 1]
+
+        # Sum relative to the block's first value, so a large offset doesn't swamp the differences
+        offset = block[0]
+        running = sums[:block.size + 1]
+        running[0] = 0
+        np.subtract(block, offset, out=running[1:])
+        np.cumsum(running, out=running)
+
+        means = out[start:stop]
+        np.subtract(running[width:], running[:-width], out=means)
+        means /= width
+        means += offset
+    return out
+
+
+def exact_means(values, width, starts):
+    """
+    The means of values[start:start + width] for each of starts, exactly as
+    np.convolve with a flat kernel gives them, e.g. to settle whether a value
+    ties with a mean from moving_mean
+    """
+    kernel = np.full(width, 1 / width)
+    return np.array([np.convolve(values[start:start + width], kernel, mode='valid')[0]
+            for start in starts])
+
+
+class MovingAverage:
+    """
+    A moving average (as moving_mean) which is fed the signal a chunk at a time.
+    The last width - 1 values are carried from one chunk to the next, so each
+    chunk gives the means of every window ending in it, and the first width - 1
+    values of the stream give no output.
+    """
+    def __init__(self, width):
+        """
+        Parameters
+        ------------
+         - width - number of values in each mean
+        """
+        self.width = width
+        self.history = np.zeros(0)
+
+    def reset(self):
+        """
+        Forget the history, to start averaging a new stream
+        """
+        self.history = np.zeros(0)
+
+    def output_size(self, chunk_size):
+        """
+        Number of means the next chunk of chunk_size values will produce
+        """
+        return max(self.history.size + chunk_size - self.width + 1, 0)
+
+    def process(self, values, out=None):
+        """
+        Average the next chunk of values
+
+        Parameters
+        ------------
+         - values - the next chunk of the signal
+         - out - optional array of size output_size(values.size) to write into
+
+        Returns
+        ------------
+         - The means of the windows ending in this chunk
+        """
+        values = np.concatenate((self.history, values))
+        out = moving_mean(values, self.width, out)
+        self.history = values[values.size - min(self.width - 1, values.size):]
+        return out
+
+
 def moving_average(signal, window_size):
     """
     Calculates the moving average of signal
@@ -45,15 +165,14 @@ def moving_average(signal, window_size):
      - out: 1D numpy array
        The moving average of the signal
     """
+    values = signal.getValues()
     window = int(window_size * signal.getFrequency())
-    kernel = np.array([1/window for _ in range(window)])
-    mov_average = np.convolve(signal.getValues(), kernel, mode='valid')
 
-    # Pad the missing values with the average of the signal
-    average = np.mean(signal.getValues())
-    missing = np.array([average for _ in range(int((signal.getValues().size - mov_average.size)/2))])
-    mov_average = np.insert(mov_average, 0, missing)
-    mov_average = np.append(mov_average, missing)
+    # Pad the missing values at either end with the average of the signal
+    mov_average = np.full(values.size, np.mean(values))
+    pad = int((window - 1) / 2)
+    size = max(values.size - window + 1, 0)
+    moving_mean(values, window, mov_average[pad:pad + size])
 
     return data.getSignal(mov_average, signal.getFrequency())
     
@@ -65,6 +184,67 @@ def plot_moving_average(signal, window_size=0.75):
     plt.show()
 
 
+def _find_runs(values, above):
+    """
+    Find the runs of True in each row of a 2D boolean array and the peak of
+    values within each run.
+
+    Inputs
+    ----------------------
+     - values: 1D or 2D numpy array
+       The signal values, one per column of above, or one per entry of it
+
+     - above: 2D numpy array
+       Boolean mask, e.g. whether each value is above each of a set of thresholds
+
+    Returns
+    ----------------------
+     - rows, starts, ends, peaks: 1D numpy arrays
+       For each run, in order, its row, first column, column after its end and the
+       column of its peak (the first maximum of values in the run)
+    """
+    rows, width = above.shape
+
+    # A False column after each row stops runs wrapping onto the next row
+    padded = np.zeros((rows, width + 1), dtype=bool)
+    padded[:, :width] = above
+    edges = np.diff(padded.ravel().view(np.int8), prepend=0)
+    starts = (edges == 1).nonzero()[0]
+    ends = (edges == -1).nonzero()[0]
+
+    # Position of every sample in a run, and which run it is in
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    run_ids = np.repeat(np.arange(starts.size), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+
+    # The first position in each run which reaches the run's maximum
+    peaks = positions[:0]
+    if starts.size > 0:
+        if values.ndim == 1:
+            run_values = np.append(values, 0)[positions % (width + 1)]
+        else:
+            run_values = np.zeros((rows, width + 1))
+            run_values[:, :width] = values
+            run_values = run_values.ravel()[positions]
+        run_max = np.maximum.reduceat(run_values, offsets)
+        hits = (run_values == run_max[run_ids]).nonzero()[0]
+        peaks = positions[hits[np.diff(run_ids[hits], prepend=-1) != 0]]
+
+    return starts // (width + 1), starts % (width + 1), ends % (width + 1), peaks % (width + 1)
+
+
+def _least_sd(peak_sets, freq):
+    """
+    Return the index of the set of peaks whose intervals have the least standard
+    deviation, calculated as find_peaks_min_sd always has. This is only needed to
+    break exact ties, which depend on its rounding.
+    """
+    if len(peak_sets) == 1:
+        return 0
+    sds = [np.std(np.diff(peaks) / freq) for peaks in peak_sets]
+    return int(np.argmin(sds))
+
 def find_peaks_min_sd(signal, window_size=0.75):
     """
     Finds the peaks based on which set of peaks gives the least standard deviation.
@@ -84,38 +264,241 @@ def find_peaks_min_sd(signal, window_size=0.75):
        The position of peaks in the data (their x positons)
 
     """
-    percs = [0, 5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90, 100, 110, 120, 150, 200, 300]
-    mov_ave = moving_average(signal, window_size)
-    mov_ave = mov_ave.getValues()
+    mov_ave = moving_average(signal, window_size).getValues()
     signal_vals = signal.getValues()
+    size = signal_vals.size
+    freq = signal.getFrequency()
 
-    min_sd = np.inf
-    current_peaks = []
-
-    for perc in percs:
-        threshold = mov_ave + mov_ave * perc / 100
-
-        #Find points above current moving average 
-        x_peaks = (signal_vals > threshold).nonzero()[0]
-        y_peaks = signal_vals[x_peaks]
-        peak_edges = (np.diff(x_peaks) > 1).nonzero()[0] + 1
+    # Find the runs above each threshold and their peaks, all at once. The first
+    # and last runs may be cut off by the window so aren't counted.
+    percs = np.array(MIN_SD_PERCS)[:, np.newaxis]
+    thresholds = mov_ave + mov_ave * percs / 100
+    above = signal_vals > thresholds
+
+    # The running sums round differently from summing each window, which only matters
+    # where the signal (e.g. when quantised) ties with a threshold. Compare those values
+    # with thresholds from the exact averages, as np.convolve gives them.
+    tolerance = MEAN_TIE_TOLERANCE * np.abs(signal_vals).max(initial=0) * (1 + percs / 100)
+    near = (np.abs(signal_vals - thresholds) <= tolerance).any(axis=0)
+    window = int(window_size * freq)
+    pad = int((window - 1) / 2)
+    ties = near.nonzero()[0]
+    ties = ties[(ties >= pad) & (ties < pad + size - window + 1)]
+    if ties.size > 0:
+        exact = exact_means(signal_vals, window, ties - pad)
+        above[:, ties] = signal_vals[ties] > exact + exact * percs / 100
+    rows, _, _, peaks = _find_runs(signal_vals, above)
+    first = np.diff(rows, prepend=-1) != 0
+    last = np.diff(rows, append=len(MIN_SD_PERCS)) != 0
+    inner = ~first & ~last
+    rows = rows[inner]
+    peaks = peaks[inner]
+
+    # Sums of the peak-peak intervals (in samples) and their squares for each threshold
+    counts = np.bincount(rows, minlength=len(MIN_SD_PERCS))
+    same = rows[1:] == rows[:-1]
+    intervals = np.diff(peaks)[same]
+    totals = np.bincount(rows[1:][same], weights=intervals, minlength=len(MIN_SD_PERCS))
+    squares = np.bincount(rows[1:][same], weights=intervals ** 2, minlength=len(MIN_SD_PERCS))
+
+    # The thresholds giving a valid heart-rate, and their interval variances n^2 var
+    rate = counts / (size / freq) * 60
+    valid = (counts >= 2) & (rate >= 40) & (rate <= 240)
+    if not valid.any():
+        return np.array([])
+    n = counts[valid] - 1
+    variances = (n * squares[valid] - totals[valid] ** 2) / (n * n)
+
+    # Take the least variance, breaking exact ties by the SD
+    tied = valid.nonzero()[0][variances == variances.min()]
+    best = tied[_least_sd([peaks[rows == i] for i in tied], freq)]
+    return peaks[rows == best]
+
+
+def sliding_rates_min_sd(signal, windows, window_size=0.75):
+    """
+    The heart-rate get_rate_min_sd gives for each of a set of (overlapping)
+    windows of signal, without searching every window from scratch. Away from
+    its ends a window's moving average is the signal's, so the runs above each
+    threshold, their peaks and running sums of the squared peak-peak intervals
+    are found once for the whole signal. Each window then only looks again at
+    the runs at its ends, where its moving average is padded with its own mean
+    and its first and last runs are cut off, so its cost is proportional to
+    those rather than to its size.
 
-        # find the maximum between the peak edges. 
-        peaks = []
-        for i in range(len(peak_edges) - 1):
-            ys = y_peaks[peak_edges[i]:peak_edges[i+1]].tolist()
-            if len(ys) > 0:
-                peaks.append(x_peaks[peak_edges[i] + ys.index(max(ys))])
+    Inputs
+    ----------------------
+     - signal: Signal
+       Heartbeat signal we want the heart-rate of
 
-        # Calculate standard deviation of the peak peak intervals
-        intervals = np.diff(peaks) / signal.getFrequency()
-        sd = np.std(intervals)
+     - windows: 2D numpy array
+       The start and stop (exclusive) sample of each window
 
-        if sd < min_sd and check_valid_hr(signal, peaks):
-            min_sd = sd
-            current_peaks = peaks
+    Returns
+    ----------------------
+     - out: 1D numpy array
+       The heart-rate (bpm) in each window
+    """
+    values = signal.getValues()
+    freq = signal.getFrequency()
+    windows = np.asarray(windows, dtype=int).reshape(-1, 2)
+    sizes = windows[:, 1] - windows[:, 0]
+    rates = np.zeros(len(windows))
+    width = int(window_size * freq)
+    pad = int((width - 1) / 2)
+    rpad = width - 1 - pad
+    percs = np.array(MIN_SD_PERCS)
+
+    # Runs above each threshold of the signal's moving average, which are the same in
+    # every window they're inside, settling ties as find_peaks_min_sd does
+    means = moving_mean(values, width)
+    inner = values[pad:pad + means.size]
+    thresholds = means + means * percs[:, np.newaxis] / 100
+    above = inner > thresholds
+    tolerance = MEAN_TIE_TOLERANCE * np.abs(values).max(initial=0) * (1 + percs[:, np.newaxis] / 100)
+    ties = (np.abs(inner - thresholds) <= tolerance).any(axis=0).nonzero()[0]
+    if ties.size > 0:
+        exact = exact_means(values, width, ties)
+        above[:, ties] = inner[ties] > exact + exact * percs[:, np.newaxis] / 100
+    run_rows, run_starts, run_ends, run_peaks = _find_runs(inner, above)
+    run_starts += pad
+    run_ends += pad
+    run_peaks += pad
+
+    # Running sums of the squared intervals between each threshold's peaks
+    same = np.diff(run_rows, prepend=-1) == 0
+    running = np.cumsum(np.where(same, np.diff(run_peaks, prepend=0), 0).astype(float) ** 2)
+
+    # The first run ending inside each window's averaged part and the last starting
+    # inside it, for every threshold. Where there are two, the window has the runs
+    # between them in common with the signal.
+    stride = values.size + 1
+    rows = np.arange(percs.size)
+    first_runs = np.searchsorted(run_rows * stride + run_ends,
+            rows * stride + windows[:, :1] + pad, side='right')
+    last_runs = np.searchsorted(run_rows * stride + run_starts,
+            rows * stride + windows[:, 1:] - rpad, side='left') - 1
+    shared = np.zeros(first_runs.shape, dtype=bool)
+    if run_rows.size > 0:
+        shared = ((first_runs < last_runs)
+                & (run_rows[np.minimum(first_runs, run_rows.size - 1)] == rows)
+                & (run_rows[np.maximum(last_runs, 0)] == rows))
+
+    # A threshold without two runs in common has at most the runs in the window's
+    # padded ends and one more, which can only give a valid rate in short windows.
+    # Those, and windows too short to average, are searched on their own.
+    most = (pad + 1) // 2 + (rpad + 1) // 2 - 1
+    alone = (sizes < width) | (~shared.all(axis=1) & (most >= 2) & (most / (sizes / freq) * 60 >= 40))
+    for i in alone.nonzero()[0]:
+        rates[i] = get_rate_min_sd(data.getSignal(values[windows[i, 0]:windows[i, 1]], freq))
+    shared[alone] = False
+
+    for block in range(0, len(windows), SLIDING_WINDOW_BLOCK):
+        # Each window and threshold with runs in common
+        pair_windows, pair_rows = shared[block:block + SLIDING_WINDOW_BLOCK].nonzero()
+        if pair_windows.size == 0:
+            continue
+        pair_windows += block
+        starts = windows[pair_windows, 0]
+        stops = windows[pair_windows, 1]
+        first = first_runs[pair_windows, pair_rows]
+        last = last_runs[pair_windows, pair_rows]
+        window_means = np.array([np.mean(values[start:stop]) for start, stop in windows[block:block + SLIDING_WINDOW_BLOCK]])
+        mean = window_means[pair_windows - block]
+        padded = (mean + mean * percs[pair_rows] / 100)[:, np.newaxis]
+
+        # The runs at the start of the window, up to the end of the first run in common
+        head_sizes = run_ends[first] - starts
+        columns = np.arange(head_sizes.max())
+        positions = starts[:, np.newaxis] + columns
+        head = values[np.minimum(positions, values.size - 1)]
+        head_above = np.where(columns < pad, head > padded,
+                above[pair_rows[:, np.newaxis], np.clip(positions - pad, 0, means.size - 1)])
+        head_above &= columns < head_sizes[:, np.newaxis]
+        head_pairs, _, _, head_peaks = _find_runs(head, head_above)
+
+        # The runs at the end of the window, from the start of the last run in common
+        tail_starts = run_starts[last]
+        tail_sizes = stops - tail_starts
+        columns = np.arange(tail_sizes.max())
+        positions = tail_starts[:, np.newaxis] + columns
+        tail = values[np.minimum(positions, values.size - 1)]
+        tail_above = np.where(positions < (stops - rpad)[:, np.newaxis],
+                above[pair_rows[:, np.newaxis], np.clip(positions - pad, 0, means.size - 1)],
+                tail > padded)
+        tail_above &= columns < tail_sizes[:, np.newaxis]
+        tail_pairs, _, _, tail_peaks = _find_runs(tail, tail_above)
+        tail_peaks += (tail_starts - starts)[tail_pairs]
+
+        # The window's first run is the first at its start and its last is the last at
+        # its end, which aren't counted, so its peaks are the rest of those at its start,
+        # those of the runs in common between, then all but the last at its end
+        pairs = pair_rows.size
+        head_first = np.diff(head_pairs, prepend=-1) != 0
+        tail_last = np.diff(tail_pairs, append=pairs) != 0
+        head_index = head_first.nonzero()[0]
+        head_stops = np.append(head_index[1:], head_peaks.size)
+        tail_index = tail_last.nonzero()[0]
+        tail_starts = np.append(0, tail_index[:-1] + 1)
+        head_counts = head_stops - head_index
+        middle_counts = last - first - 1
+        tail_counts = tail_index + 1 - tail_starts
+        counts = head_counts - 1 + middle_counts + tail_counts - 1
+
+        # Squared intervals within each part, then across the joins between them
+        joined = (head_pairs[1:] == head_pairs[:-1]) & ~head_first[:-1]
+        head_squares = np.bincount(head_pairs[1:][joined],
+                weights=np.diff(head_peaks)[joined] ** 2, minlength=pairs)
+        joined = (tail_pairs[1:] == tail_pairs[:-1]) & ~tail_last[1:]
+        tail_squares = np.bincount(tail_pairs[1:][joined],
+                weights=np.diff(tail_peaks)[joined] ** 2, minlength=pairs)
+        middle_first = run_peaks[np.minimum(first + 1, last)] - starts
+        middle_last = run_peaks[np.maximum(last - 1, first)] - starts
+        middle_squares = running[np.maximum(last - 1, first)] - running[np.minimum(first + 1, last)]
+        head_second = head_peaks[np.minimum(head_index + 1, head_peaks.size - 1)]
+        head_last = head_peaks[head_stops - 1]
+        tail_first = tail_peaks[tail_starts]
+        tail_penultimate = tail_peaks[np.maximum(tail_index - 1, 0)]
+
+        has_head = head_counts >= 2
+        has_middle = middle_counts >= 1
+        has_tail = tail_counts >= 2
+        squares = (head_squares + tail_squares
+                + np.where(has_middle, middle_squares, 0)
+                + np.where(has_head & has_middle, (middle_first - head_last) ** 2, 0)
+                + np.where(has_tail & (has_head | has_middle),
+                        (tail_first - np.where(has_middle, middle_last, head_last)) ** 2, 0))
+        totals = np.where(counts >= 1,
+                np.where(has_tail, tail_penultimate, np.where(has_middle, middle_last, head_last))
+                - np.where(has_head, head_second, np.where(has_middle, middle_first, tail_first)),
+                0).astype(float)
+
+        # The thresholds giving a valid heart-rate, and their interval variances n^2 var,
+        # as find_peaks_min_sd
+        rate = counts / (sizes[pair_windows] / freq) * 60
+        valid = (counts >= 2) & (rate >= 40) & (rate <= 240)
+        n = counts[valid] - 1
+        variances = np.full(pairs, np.inf)
+        variances[valid] = (n * squares[valid] - totals[valid] ** 2) / (n * n)
+
+        # Take each window's least variance, breaking exact ties by the SD
+        window_first = np.diff(pair_windows, prepend=-1) != 0
+        window_ids = np.cumsum(window_first) - 1
+        least = np.minimum.reduceat(variances, window_first.nonzero()[0])
+        tied = (valid & (variances == least[window_ids])).nonzero()[0]
+        best = tied[np.diff(pair_windows[tied], prepend=-1) != 0]
+        for i in np.unique(pair_windows[tied][np.diff(pair_windows[tied], prepend=-1) == 0]):
+            candidates = tied[pair_windows[tied] == i]
+            peak_sets = [np.concatenate((
+                    head_peaks[head_index[pair] + 1:head_stops[pair]],
+                    run_peaks[first[pair] + 1:last[pair]] - starts[pair],
+                    tail_peaks[tail_starts[pair]:tail_index[pair]]))
+                for pair in candidates]
+            best[np.searchsorted(pair_windows[best], i)] = candidates[_least_sd(peak_sets, freq)]
+        rates[pair_windows[best]] = counts[best] / (sizes[pair_windows[best]] / freq) * 60
+
+    return rates
 
-    return np.array(current_peaks)
 
 def check_valid_hr(signal, peaks):
     """
@@ -0,0 +1,159 @@
+"""
+Binary cache of recordings. Each recording file (a CSV from the watch or an EDF
+from the ECG) can be converted to a directory of .npy files, one per column or
+channel, which are opened memory-mapped so they load in milliseconds and are
+only paged in from disk as they are used.
+
+The cache for a file lives in .cache/<file name>/ next to the file, and is only
+used while it is fresh, i.e. the source file hasn't changed since conversion.
+"""
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import pyedflib
+import watchdata
+
+CACHE_DIRECTORY = ".cache"
+METADATA_FILE = "metadata.json"
+
+# Increase to invalidate all existing caches if the layout changes
+FORMAT_VERSION = 1
+
+
+def getCachePath(sourcePath):
+    """
+    Return the directory in which the cache for sourcePath is stored
+    """
+    directory, name = os.path.split(os.path.abspath(sourcePath))
+    return os.path.join(directory, CACHE_DIRECTORY, name)
+
+
+def _sourceStamp(sourcePath):
+    stat = os.stat(sourcePath)
+    return {"version": FORMAT_VERSION, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def isFresh(sourcePath):
+    """
+    Return whether there is a cache for sourcePath made from its current contents
+    """
+    metadataPath = os.path.join(getCachePath(sourcePath), METADATA_FILE)
+    if not os.path.isfile(metadataPath) or not os.path.isfile(sourcePath):
+        return False
+
+    with open(metadataPath) as f:
+        metadata = json.load(f)
+    return metadata.get("source") == _sourceStamp(sourcePath)
+
+
+def save(sourcePath, columns, metadata=None):
+    """
+    Store columns as the cache for sourcePath.
+
+    Parameters
+    ----------
+    sourcePath : str
+        The file the columns were read from.
+
+    columns : dict
+        Maps column names to 1D numpy arrays.
+
+    metadata : dict
+        Any extra JSON serialisable information to keep with the columns, such
+        as sampling frequencies.
+    """
+    cachePath = getCachePath(sourcePath)
+    tmpPath = cachePath + ".tmp"
+    shutil.rmtree(tmpPath, ignore_errors=True)
+    os.makedirs(tmpPath)
+
+    names = list(columns)
+    for i, name in enumerate(names):
+        np.save(os.path.join(tmpPath, "{}.npy".format(i)), np.asarray(columns[name]))
+
+    metadata = dict(metadata or {})
+    metadata["columns"] = names
+    metadata["source"] = _sourceStamp(sourcePath)
+    with open(os.path.join(tmpPath, METADATA_FILE), "w") as f:
+        json.dump(metadata, f)
+
+    # Swap the new cache in, so readers never see a half written one
+    shutil.rmtree(cachePath, ignore_errors=True)
+    os.rename(tmpPath, cachePath)
+
+
+def load(sourcePath):
+    """
+    Open the cache for sourcePath, if it is fresh.
+
+    Returns
+    -------
+    out : (dict, dict) or None
+        The columns, as read-only memory-mapped numpy arrays, and the metadata
+        they were saved with. None if there is no fresh cache.
+    """
+    if not isFresh(sourcePath):
+        return None
+
+    cachePath = getCachePath(sourcePath)
+    with open(os.path.join(cachePath, METADATA_FILE)) as f:
+        metadata = json.load(f)
+
+    columns = {}
+    for i, name in enumerate(metadata["columns"]):
+        columns[name] = np.load(os.path.join(cachePath, "{}.npy".format(i)), 
+                mmap_mode='r')
+    return columns, metadata
+
+
+def convertCsv(path, columns):
+    """
+    Parse a recording CSV file and store the columns we use in the cache
+    """
+    save(path, watchdata.readColumns(path, columns))
+
+
+def convertRecording(directory):
+    """
+    Convert every known CSV file in a watch recording directory whose cache is stale
+    """
+    for fileName, columns in watchdata.COLUMNS.items():
+        path = os.path.join(directory, fileName)
+        if os.path.isfile(path) and not isFresh(path):
+            convertCsv(path, columns)
+
+
+def convertEdf(path):
+    """
+    Read every channel of an EDF file and store them, with their labels and
+    sample frequencies, in the cache
+    """
+    edf = pyedflib.EdfReader(path)
+    try:
+        labels = edf.getSignalLabels()
+        columns = {label: edf.readSignal(i) for i, label in enumerate(labels)}
+        frequencies = [edf.getSampleFrequency(i) for i in range(len(labels))]
+    finally:
+        edf.close()
+
+    save(path, columns, {"labels": labels, "frequencies": frequencies})
+
+
+def convert(path):
+    """
+    Convert a watch recording directory or an ECG EDF file, if its cache is stale
+    """
+    if os.path.isdir(path):
+        convertRecording(path)
+    elif not isFresh(path):
+        convertEdf(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise ValueError("Expected usage: recordingcache.py (ecgFile | watchDir)...")
+
+    for path in sys.argv[1:]:
+        convert(path)
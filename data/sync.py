@@ -10,10 +10,76 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import scipy
+import scipy.signal
 import data
 from spectrum import Periodogram
 
-def correlate(f, g):
+# Below this many multiply-adds the direct method beats the FFT set-up cost
+DIRECT_CORRELATION_LIMIT = 1e6
+
+# If f is this many times longer than g, use overlap-add rather than one big FFT
+OVERLAP_RATIO = 4
+
+# The sync search decimates by SYNC_PYRAMID_FACTOR until the next level would be below
+# SYNC_COARSE_FREQ (hz), searches every lag there, then refines the lag at each finer
+# level within SYNC_SEARCH_BOUND samples (of the coarser level) either side
+SYNC_COARSE_FREQ = 8
+SYNC_PYRAMID_FACTOR = 4
+SYNC_SEARCH_BOUND = 2
+
+# With drift compensation, a segment of SYNC_SEGMENT_LENGTH seconds of the watch
+# acceleration is matched every SYNC_SEGMENT_INTERVAL seconds, within SYNC_DRIFT_BOUND
+# seconds of where the last match predicts. Segments whose correlation coefficient
+# is below SYNC_MIN_COEFFICIENT (e.g. with no movement) are ignored.
+SYNC_SEGMENT_LENGTH = 60
+SYNC_SEGMENT_INTERVAL = 300
+SYNC_DRIFT_BOUND = 5
+SYNC_MIN_COEFFICIENT = 0.3
+
+
+def crossCorrelate(f, g, method="auto"):
+    """
+    Calculate every lag of the cross correlation c of two numpy arrays, as defined by
+    c[k] = sum_n (f[n+k] * g[n]), for k in 0 .. f.size - g.size.
+
+    Parameters
+    ----------
+    f, g : numpy array
+        Input signals, f must be at least as long as g.
+
+    method : str
+        'direct' computes the sums directly, 'fft' uses a single FFT, 'overlap' uses blockwise
+        FFTs (overlap-add) which is fastest when f is much longer than g. 'auto' picks one of
+        these based on the sizes of f and g.
+
+    Returns
+    -------
+    c : numpy array
+        The cross correlation, of size f.size - g.size + 1.
+    """
+    if f.size < g.size:
+        raise ValueError("Array f must be larger than g")
+
+    if method == "auto":
+        work = g.size * (f.size - g.size + 1)
+        if work < DIRECT_CORRELATION_LIMIT:
+            method = "direct"
+        elif f.size > OVERLAP_RATIO * g.size:
+            method = "overlap"
+        else:
+            method = "fft"
+
+    if method == "direct":
+        return np.correlate(f, g, mode='valid')
+    elif method == "fft":
+        return scipy.signal.fftconvolve(f, g[::-1], mode='valid')
+    elif method == "overlap":
+        return scipy.signal.oaconvolve(f, g[::-1], mode='valid')
+    else:
+        raise ValueError("Unknown correlation method {}".format(method))
+
+
+def correlate(f, g, method="auto"):
     """
     Calculate cross correlation c of two numpy arrays, as defined by c[k] = sum_n (f[n+k] * g[n])
 
@@ -22,6 +88,9 @@ def correlate(f, g):
     f, g : numpy array
         Input signals.
 
+    method : str
+        Correlation method, see crossCorrelate.
+
     Returns
     -------
     k : int
@@ -36,20 +105,22 @@ def correlate(f, g):
 
     length = f.size - g.size
 
-    c = np.zeros((length))
-    for k in range(length):
-        # Vectorized solution to sum_n(f[n+k] * g[n])
-        c[k] = np.sum(f[k : k + g.size] * g)
+    c = crossCorrelate(f, g, method)[:length]
 
     k = np.argmax(c)
     v = c[k]
 
     return (k, v)
 
-def fastCorrelate(f, g, freq, initTimeGap = 0.25, searchBound = 3):
+def fastCorrelate(f, g, freq, initTimeGap = 0.25, searchBound = 3, method="auto"):
     """
-    Calculate cross correlation c of two numpy arrays, as defined by c[k] = sum_n (f[n+k] * g[n])
-    using optimized method which does an initial correlation at a lower resolution and then hones in on the solution.
+    Calculate cross correlation c of two numpy arrays, as defined by c[k] = sum_n (f[n+k] * g[n]),
+    and find where it's largest.
+
+    This used to do an initial correlation at a lower resolution (every initTimeGap seconds) and
+    then hone in on the solution (within searchBound seconds). crossCorrelate now computes every
+    lag at once, in less time than that search took, so this is correlate, and finds the true
+    maximum. freq, initTimeGap and searchBound are kept so existing calls still work.
 
     Parameters
     ----------
@@ -60,11 +131,13 @@ def fastCorrelate(f, g, freq, initTimeGap = 0.25, searchBound = 3):
         The frequency of the signals.
 
     initTimeGap : float
-        Interval at which to perform correlation intially in seconds. 
+        Unused, was the interval at which to perform correlation initially in seconds.
 
     searchBound : float
-        Bound wihtin which we search for the solution once we have made an initial pass.
-        
+        Unused, was the bound within which to search for the solution after the initial pass.
+
+    method : str
+        Correlation method, see crossCorrelate.
 
     Returns
     -------
@@ -75,29 +148,76 @@ def fastCorrelate(f, g, freq, initTimeGap = 0.25, searchBound = 3):
     v : float
         the value of cross correlation at that point (c[k])
     """
-    if f.size < g.size:
-        raise ValueError("Array f must be larger than g")
+    return correlate(f, g, method)
 
-    length = f.size - g.size
 
-    gap = int(initTimeGap * freq)
+def pyramidCorrelate(f, g, freq, maxLag, coarseFreq=SYNC_COARSE_FREQ,
+        factor=SYNC_PYRAMID_FACTOR, searchBound=SYNC_SEARCH_BOUND):
+    """
+    Find the lag, positive or negative, which maximises the absolute cross correlation
+    c[k] = sum_n (f[n+k] * g[n]) of two numpy arrays, with a coarse-to-fine search.
+
+    Both arrays are decimated (with anti-aliasing) by factor, repeatedly, down to about
+    coarseFreq, where every lag of both signs is found by one full correlation, each lag
+    averaged over the samples which overlap at it. The best lag is then refined at each
+    finer level, correlating only the few lags around it.
+
+    Parameters
+    ----------
+    f, g : numpy arrays
+        Input signals.
+
+    freq : float
+        The frequency of the signals.
 
-    c = np.zeros((length))
-    for k in range(0, length, gap):
-        c[k] = np.sum(f[k : k + g.size] * g)
+    maxLag : int
+        Largest lag (in samples, either way) to consider.
 
-    maxPos = np.argmax(c)
-    bound = searchBound * freq
-    lowerBound = max(maxPos - bound, 0)
-    upperBound = min(maxPos + bound, length)
-    for k in range(lowerBound, upperBound, 1):
-        c[k] = np.sum(f[k : k + g.size] * g)
+    coarseFreq : float
+        Lowest frequency decimated to.
 
+    factor : int
+        Factor by which each level is decimated.
 
-    k = np.argmax(c)
-    v = c[k]
+    searchBound : int
+        Bound (in samples of the coarser level) within which each finer level looks
+        around the coarser level's lag.
 
-    return (k, v)
+    Returns
+    -------
+    k : int
+        The lag (in samples) at which we think the signals are synced, i.e. the value of
+        k which maximizes |c[k]|. Positive if f starts earlier than g.
+
+    v : float
+        the value of cross correlation at that point (c[k])
+    """
+    maxLag = min(maxLag, f.size - 1, g.size - 1)
+
+    if freq / factor < coarseFreq:
+        # lags[i] = i - (g.size - 1), each divided by how many samples overlap at it
+        c = scipy.signal.correlate(f, g, mode='full')
+        lags = np.arange(c.size) - (g.size - 1)
+        overlap = np.minimum(f.size, g.size + lags) - np.maximum(lags, 0)
+        inRange = np.absolute(lags) <= maxLag
+        i = np.argmax(np.absolute(c[inRange]) / overlap[inRange])
+        return (lags[inRange][i], c[inRange][i])
+
+    coarseF = data.getSignal(f, freq).resample(freq / factor, "polyphase").getValues()
+    coarseG = data.getSignal(g, freq).resample(freq / factor, "polyphase").getValues()
+    coarse, _ = pyramidCorrelate(coarseF, coarseG, freq / factor, maxLag // factor,
+            coarseFreq, factor, searchBound)
+
+    # Refine around the coarser lag, each lag averaged over the samples which overlap at
+    # it, as at the coarsest level
+    lags = np.arange(max(coarse * factor - searchBound * factor, -maxLag),
+            min(coarse * factor + searchBound * factor, maxLag) + 1)
+    c = np.array([np.dot(f[max(lag, 0):min(f.size, g.size + lag)],
+            g[max(-lag, 0):min(g.size, f.size - lag)]) for lag in lags])
+    overlap = np.minimum(f.size, g.size + lags) - np.maximum(lags, 0)
+
+    i = np.argmax(np.absolute(c) / overlap)
+    return (lags[i], c[i])
 
 
 def testCorrelation():
@@ -117,6 +237,8 @@ def testCorrelation():
 
     print(fastCorrelate(f[:120*freq], g, freq))
 
+    print(pyramidCorrelate(f[:int(240*freq)], g[:int(240*freq)], freq, int(120*freq)))
+
 
 
 
@@ -130,32 +252,102 @@ class Sync:
     """
     Initialize synchronization class, provided the EDF file from the portable ECG and the directory
     containing the data from a smart watch.
+
+    Watch channels are loaded, and the time difference calculated, at most once per Sync object
+    (EcgData keeps the ECG channels it has decoded itself). The results are kept in a cache, which
+    clearCache() empties. Synced signals depend on the crop, so
+    they are cached separately and discarded whenever setStartCrop or setEndCrop is called.
+
+    The watch's clock drifts relative to the ECG's, so over long recordings one time difference
+    doesn't keep them aligned. setDriftCompensation(True) syncs with a model of the drift instead,
+    see getClockDrift.
+
+    ecgData and watchData can be given to share the already opened recordings of another Sync, as
+    the EDF file can only be opened once at a time.
     """
-    def __init__(self, ecgFile, watchDirectory):
-        self.ecgData = ecgdata.getEcgData(ecgFile)
-        self.watchData = watchdata.getWatchData(watchDirectory)
+    def __init__(self, ecgFile, watchDirectory, ecgData=None, watchData=None):
+        self.ecgFile = ecgFile
+        self.watchDirectory = watchDirectory
+        self.ecgData = ecgdata.getEcgData(ecgFile) if ecgData is None else ecgData
+        self.watchData = watchdata.getWatchData(watchDirectory) if watchData is None else watchData
         self.startCrop = 120
         self.endCrop = 30
+        self.drift = False
+        self._cache = {}
+        self._syncedCache = {}
 
     def setStartCrop(self, crop):
+        if crop != self.startCrop:
+            self._syncedCache.clear()
         self.startCrop = crop
 
     def setEndCrop(self, crop):
+        if crop != self.endCrop:
+            self._syncedCache.clear()
         self.endCrop = crop
 
-    def getECG_x(self):
-        signal = self.ecgData.getAcceleration("x")
+    def setDriftCompensation(self, drift):
+        if drift != self.drift:
+            self._syncedCache.clear()
+        self.drift = drift
+
+    def clearCache(self):
+        """
+        Forget all loaded channels and computed results, e.g. if the recording files have changed.
+        """
+        self._cache.clear()
+        self._syncedCache.clear()
+
+    def _cached(self, key, compute, cache=None):
+        """
+        Return cache[key], calling compute() to fill it in if it is not yet present.
+        """
+        if cache is None:
+            cache = self._cache
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+    def _copy(self, signal):
+        """
+        Signals can be changed (with __setitem__), so callers get their own Signal of cached
+        ones. It shares the cached values, which are copied if it is changed.
+        """
+        return data.getSignal(signal.getValues(), signal.getFrequency())
+
+    def _synced(self, key, compute):
+        """
+        Return a copy of the crop dependent result for key, computing it if necessary.
+        """
+        result = self._cached(key, compute, self._syncedCache)
+        if isinstance(result, tuple):
+            return tuple(self._copy(signal) for signal in result)
+        return self._copy(result)
+
+    def _getPPG(self, ppgSensor):
+        return self._cached(("ppg", ppgSensor), 
+                lambda: self.watchData.getPPG(sensor=ppgSensor))
+
+    def _getAcceleration(self, axis):
+        return self._cached(("acceleration", axis), 
+                lambda: self.watchData.getAcceleration(axis))
+
+    def _getHR(self):
+        return self._cached("hr", lambda: self.watchData.getHR()[0])
+
+    def getECG_x(self, length=None):
+        signal = self.ecgData.getAcceleration("x", length=length)
         return signal.getValues()
 
     def getECG_freq(self):
-        signal = self.ecgData.getAcceleration("x")
-        return signal.getFrequency()
+        return self.ecgData.getAccelerationFrequency("x")
 
     def getPPGLength(self):
         """
         Get length in seconds of PPG data
         """
-        return self.watchData.getPPG().getValues().size / self.watchData.getPPG().getFrequency()
+        ppg = self._getPPG(1)
+        return ppg.size / ppg.getFrequency()
         
         
 
@@ -163,15 +355,11 @@ class Sync:
     """
     Resample a given numpy array signal from currentFreq (hz) to newFreq (hz).
     """
-    def resample(self, signal, currentFreq, newFreq):
-        resampled = np.interp(np.arange(0, signal.size, currentFreq/newFreq),
-                np.arange(0, signal.size, 1), signal)
-
-        return resampled
+    def resample(self, signal, currentFreq, newFreq, method="linear"):
+        return data.getSignal(signal, currentFreq).resample(newFreq, method).getValues()
 
     def normalize(self, signal):
-        mean = np.mean(signal)
-        signal -= mean
+        signal = signal - np.mean(signal)
         amplitude = np.absolute(signal).max()
         signal /= amplitude
         return signal
@@ -179,19 +367,23 @@ class Sync:
     """
     The two methods below return a numpy array containing acceleration along 
     the appropriate up axis, sampled at the same rate (the ECG rate).
+    length limits the signal to its first length seconds, None for all of it.
     """
-    def _getWatchAccelUp(self):
-        ecgFreq = self.getECG_freq()
-        watchY = self.watchData.getAcceleration('y').getValues()
-        watchFreq = self.watchData.getAcceleration('y').getFrequency()
-        watchY = self.resample(watchY, watchFreq, ecgFreq)
-        watchY = self.normalize(watchY)
-        freq = self.watchData.getAcceleration('y').getFrequency()
-        return watchY
-
-    def _getECGAccelUp(self):
-        ecgX = self.normalize(self.getECG_x())
-        return ecgX
+    def _getWatchAccelUp(self, length=None):
+        def compute():
+            ecgFreq = self.getECG_freq()
+            # Resampled using the watch's timestamps, so jitter doesn't add up
+            watchY = self._getAcceleration('y').resample(ecgFreq).getValues()
+            if length is not None:
+                watchY = watchY[:int(length * ecgFreq)]
+            return self.normalize(watchY)
+
+        return data.shareValues(self._cached(("watchAccelUp", length), compute))
+
+    def _getECGAccelUp(self, length=None):
+        ecgX = self._cached(("ecgAccelUp", length), 
+                lambda: self.normalize(self.getECG_x(length)))
+        return data.shareValues(ecgX)
 
     def getFrequency(self):
         return self.getECG_freq()
@@ -205,13 +397,14 @@ class Sync:
         - timeLimit = the time in which you expect to be able to sync data. E.g. the time in which three jumps happen.
     """
     def getCrossCorrelation(self, watchFirst=True, timeLimit=120):
-        watch = self._getWatchAccelUp()
-        ecg = self._getECGAccelUp()
+        # Only the first 2 * timeLimit seconds are correlated, so only read that much of the ECG
+        watch = self._getWatchAccelUp(2 * timeLimit)
+        ecg = self._getECGAccelUp(2 * timeLimit)
         numSamples = int(timeLimit * self.getFrequency())
         if watchFirst:
-            correlation = np.correlate(ecg[:numSamples*2], watch[:numSamples], mode='valid')
+            correlation = crossCorrelate(ecg[:numSamples*2], watch[:numSamples])
         else:
-            correlation = np.correlate(watch[:numSamples*2], ecg[:numSamples], mode='valid')
+            correlation = crossCorrelate(watch[:numSamples*2], ecg[:numSamples])
         return correlation
 
     """
@@ -219,21 +412,92 @@ class Sync:
     is positive, the watch started first, if negative the ECG started first.
     """
     def getTimeDifference(self):
-        # Take absolute values of cross correlation, as signals may be inverted so cross correlation negative. We take
-        # cross correlation assuming both watch started recording first and ecg started recording first in order to find
-        # the maximum cross correlation between them.
-        watchCorrelation = np.absolute(self.getCrossCorrelation(watchFirst=True))
-        ecgCorrelation = np.absolute(self.getCrossCorrelation(watchFirst=False))
-
-        if watchCorrelation.max() > ecgCorrelation.max():
-            delta = np.argmax(watchCorrelation)
-        else:
-            delta = -np.argmax(ecgCorrelation)
+        return self._cached("timeDifference", self._calculateTimeDifference)
+
+    def _calculateTimeDifference(self, timeLimit=120):
+        # Signals may be inverted so the cross correlation is negative, so pyramidCorrelate maximises its
+        # absolute value. The lags for both the watch and the ecg starting first come from the same
+        # correlation of the first 2 * timeLimit seconds.
+        freq = self.getFrequency()
+        watch = self._getWatchAccelUp(2 * timeLimit)
+        ecg = self._getECGAccelUp(2 * timeLimit)
 
-        timeDiff = delta / self.getFrequency()
+        delta, _ = pyramidCorrelate(ecg, watch, freq, int(timeLimit * freq))
+
+        timeDiff = delta / freq
         return timeDiff
 
 
+    """
+    Estimate the drift of the watch's clock relative to the ECG's. Segments of the watch's acceleration
+    are matched to the ECG's at regular intervals along the recordings, and a line fitted to the time
+    differences found.
+
+    Returns (offset, drift): the watch sample recorded t seconds after the watch's acceleration started
+    lines up with the ECG sample offset + t * (1 + drift) seconds after the ECG started.
+    """
+    def getClockDrift(self):
+        return self._cached("clockDrift", self._calculateClockDrift)
+
+    def _calculateClockDrift(self):
+        freq = self.getFrequency()
+        watch = self._getWatchAccelUp()
+        ecg = self._getECGAccelUp()
+        length = int(SYNC_SEGMENT_LENGTH * freq)
+        bound = int(SYNC_DRIFT_BOUND * freq)
+
+        # Where the next segment is expected to match, in samples
+        shift = int(round(self.getTimeDifference() * freq))
+
+        times = []
+        differences = []
+        weights = []
+        for start in range(0, watch.size - length + 1, int(SYNC_SEGMENT_INTERVAL * freq)):
+            ecgStart = max(start + shift - bound, 0)
+            window = ecg[ecgStart:start + shift + length + bound]
+            if window.size < length:
+                break
+            segment = watch[start:start + length]
+
+            c = np.absolute(crossCorrelate(window, segment))
+            k = np.argmax(c)
+            coefficient = c[k] / (np.linalg.norm(segment) * np.linalg.norm(window[k:k + length]))
+            if not coefficient >= SYNC_MIN_COEFFICIENT:
+                continue
+
+            shift = ecgStart + k - start
+            times.append((start + length / 2) / freq)
+            differences.append(shift / freq)
+            weights.append(coefficient)
+
+        if len(times) < 2:
+            return (self.getTimeDifference(), 0)
+
+        drift, offset = np.polyfit(times, differences, 1, w=weights)
+        return (offset, drift)
+
+    def _getSyncStart(self):
+        """
+        Time (s) after the ECG started that the synced signals start, with drift compensation
+        """
+        offset, _ = self.getClockDrift()
+        return max(offset, 0)
+
+    def _alignWatch(self, signal, freq=None):
+        """
+        Resample a watch signal onto the ECG's timeline, with the clock drift model, in one pass. The
+        result starts at _getSyncStart and is at freq (hz), the signal's frequency if None.
+        """
+        offset, drift = self.getClockDrift()
+        if freq is None:
+            freq = signal.getFrequency()
+
+        watchStart = self._getAcceleration('y').getTimes()[0]
+        times = offset * 1000 + (signal.getTimes() - watchStart) * (1 + drift)
+        values = data.resampleTimes(signal.getValues(), times, freq,
+                start=self._getSyncStart() * 1000)
+        return data.getSignal(values, freq)
+
     def crop(self, signal):
         """
         Crops signal to between startCrop seconds from the start and endCrop from the end.
@@ -263,12 +527,19 @@ class Sync:
     be 1 or 2)
     """
     def getSyncedSignals(self, ppgSensor=1):
+        return self._synced(("signals", ppgSensor), 
+                lambda: self._calculateSyncedSignals(ppgSensor))
+
+    def _calculateSyncedSignals(self, ppgSensor):
+        if self.drift:
+            return self._calculateSyncedECG(), self._calculateSyncedPPG(ppgSensor)
+
         # Get ECG signal and frequency
         ecg = self.ecgData.getECG()
         ecgFreq = ecg.getFrequency()
         ecgSignal = ecg.getValues()
 
-        ppg = self.watchData.getPPG(sensor=ppgSensor)
+        ppg = self._getPPG(ppgSensor)
         ppgFreq = ppg.getFrequency()
         ppgSignal = ppg.getValues()
 
@@ -297,16 +568,23 @@ class Sync:
     1 or 2)
     """
     def getSyncedSignalsHighFrequency(self, ppgSensor=1):
+        return self._synced(("signalsHighFrequency", ppgSensor), 
+                lambda: self._calculateSyncedSignalsHighFrequency(ppgSensor))
+
+    def _calculateSyncedSignalsHighFrequency(self, ppgSensor):
         # Get ECG signal and frequency
         ecg = self.ecgData.getECG()
         ecgFreq = ecg.getFrequency()
         ecgSignal = ecg.getValues()
 
+        if self.drift:
+            ppg = self._alignWatch(self._getPPG(ppgSensor), ecgFreq)
+            ppg = self.crop(data.getSignal(self.normalize(ppg.getValues()), ecgFreq))
+            return self._calculateSyncedECG(), ppg
+
         # Get PPG signal resampled at ECG's frequency
-        ppg = self.watchData.getPPG(sensor=ppgSensor)
-        ppgFreq = ppg.getFrequency()
-        ppgSignal = ppg.getValues()
-        ppgSignal = self.resample(ppgSignal, ppgFreq, ecgFreq)
+        ppg = self._getPPG(ppgSensor)
+        ppgSignal = ppg.resample(ecgFreq).getValues()
 
         ppgSignal = self.normalize(ppgSignal)
         ecgSignal = self.normalize(ecgSignal)
@@ -330,7 +608,15 @@ class Sync:
     Return the synced ppgSignal, at it's original frequency
     """ 
     def getSyncedPPG(self, ppgSensor=1):
-        ppg = self.watchData.getPPG(sensor=ppgSensor)
+        return self._synced(("ppg", ppgSensor), 
+                lambda: self._calculateSyncedPPG(ppgSensor))
+
+    def _calculateSyncedPPG(self, ppgSensor):
+        if self.drift:
+            ppg = self._alignWatch(self._getPPG(ppgSensor))
+            return self.crop(data.getSignal(self.normalize(ppg.getValues()), ppg.getFrequency()))
+
+        ppg = self._getPPG(ppgSensor)
         ppgFreq = ppg.getFrequency()
         ppgSignal = ppg.getValues()
         ppgSignal = self.normalize(ppgSignal)
@@ -356,6 +642,33 @@ class Sync:
         ecg : Signal object
             The ECG signal, after being synced with the wristwatch
         """
+        return self._synced("ecg", self._calculateSyncedECG)
+
+    def getSyncedECGRange(self):
+        """
+        Return the first sample of the ECG channel in the synced ECG, and the sample after
+        its last, so the synced ECG can be read straight from ecgData in parts
+
+        Returns
+        -------
+        start, stop : int
+            The samples the synced ECG is between, after the sync offset and crop
+        """
+        ecgFreq = self.ecgData.getFrequency("ECG")
+        timeDiff = self.getTimeDifference()
+
+        start = 0
+        if self.drift:
+            start = int(self._getSyncStart() * ecgFreq)
+        # timeDiff > 0 means ecg started sooner
+        elif timeDiff > 0:
+            start = int(abs(timeDiff) * ecgFreq)
+
+        start += int(ecgFreq*self.startCrop)
+        stop = self.ecgData.getLength("ECG") - int(ecgFreq*self.endCrop)
+        return start, max(stop, start)
+
+    def _calculateSyncedECG(self):
         # Get ECG signal and frequency
         ecg = self.ecgData.getECG()
         ecgFreq = ecg.getFrequency()
@@ -365,8 +678,10 @@ class Sync:
         timeDiff = self.getTimeDifference()
         delta = int(abs(timeDiff) * ecgFreq)
 
+        if self.drift:
+            ecgSignal = ecgSignal[int(self._getSyncStart() * ecgFreq):]
         # timeDiff > 0 means ecg started sooner
-        if timeDiff > 0:
+        elif timeDiff > 0:
             ecgSignal = ecgSignal[delta:]
 
         ecg = self.crop(data.getSignal(ecgSignal, ecgFreq))
@@ -378,7 +693,14 @@ class Sync:
     Return the synced acceleration of the wristwatch, along parameter axis.
     """
     def getSyncedAcceleration(self, axis):
-        acc = self.watchData.getAcceleration(axis)
+        return self._synced(("acceleration", axis), 
+                lambda: self._calculateSyncedAcceleration(axis))
+
+    def _calculateSyncedAcceleration(self, axis):
+        if self.drift:
+            return self.crop(self._alignWatch(self._getAcceleration(axis)).normalize())
+
+        acc = self._copy(self._getAcceleration(axis))
         acc = acc.normalize()
         accFreq = acc.getFrequency()
         accValues = acc.getValues()
@@ -397,7 +719,13 @@ class Sync:
     Return the synced heart-rate of the wristwatch
     """
     def getSyncedHR(self):
-        hr, accuracy = self.watchData.getHR()
+        return self._synced("hr", self._calculateSyncedHR)
+
+    def _calculateSyncedHR(self):
+        if self.drift:
+            return self.crop(self._alignWatch(self._getHR()))
+
+        hr = self._getHR()
 
         time_diff = self.getTimeDifference()
         delta = int(abs(time_diff) * hr.frequency)
@@ -0,0 +1,89 @@
+"""
+Shared fixtures: a synthetic pair of recordings, laid out as in an archive (see
+batch), whose watch started OFFSET seconds after the ECG.
+"""
+import datetime
+import os
+import sys
+import numpy as np
+import pandas
+import pyedflib
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ECG_START = datetime.datetime(2020, 1, 18, 13, 55, 42)
+OFFSET = 7
+DURATION = 400
+BPM = 72
+
+
+def _motion(times, seed=0):
+    """
+    Smooth random movement (a few hz at most) at times (s), the same for both devices
+    """
+    rng = np.random.default_rng(seed)
+    knots = np.arange(-10, DURATION + 20, 0.25)
+    return np.interp(times, knots, rng.standard_normal(knots.size))
+
+
+def _writeEcg(path):
+    ecgFreq, accelFreq = 256, 32
+    times = np.arange(DURATION * ecgFreq) / ecgFreq
+    # Sharp R waves, one per beat
+    phase = (times * BPM / 60) % 1
+    ecg = np.exp(-((phase - 0.5) / 0.01) ** 2) - 0.1 * np.exp(-((phase - 0.3) / 0.05) ** 2)
+    accelTimes = np.arange(DURATION * accelFreq) / accelFreq
+    accel = _motion(accelTimes)
+
+    headers = [{"label": label, "dimension": "u", "sample_frequency": freq,
+        "physical_max": 5.0, "physical_min": -5.0, "digital_max": 32767,
+        "digital_min": -32768, "prefilter": "", "transducer": ""}
+        for label, freq in [("ECG", ecgFreq), ("Accelerometer_X", accelFreq),
+            ("Accelerometer_Y", accelFreq), ("Accelerometer_Z", accelFreq)]]
+    pyedflib.highlevel.write_edf(path, [ecg, accel, 0.1 * accel, -accel], headers,
+            {"startdate": ECG_START})
+
+
+def _writeWatch(directory):
+    start = int((ECG_START + datetime.timedelta(seconds=OFFSET)).timestamp() * 1000)
+    duration = DURATION - 2 * OFFSET
+
+    def times(freq):
+        return start + np.arange(int(duration * freq)) * int(1000 / freq)
+
+    accelTimes = times(50)
+    motion = _motion((accelTimes - start) / 1000 + OFFSET)
+    pandas.DataFrame({"time": accelTimes, "x": 0.5 * motion, "y": motion, "z": -motion}
+            ).to_csv(os.path.join(directory, "accelerometer.csv"), index=False)
+
+    ppgTimes = times(25)
+    ppg = np.sin(2 * np.pi * BPM / 60 * (ppgTimes - start) / 1000)
+    pandas.DataFrame({"time": ppgTimes, "value": ppg, "value2": ppg}
+            ).to_csv(os.path.join(directory, "ppg.csv"), index=False)
+
+    hrTimes = times(1)
+    pandas.DataFrame({"time": hrTimes, "value": BPM, "accuracy": 3}
+            ).to_csv(os.path.join(directory, "hr.csv"), index=False)
+    pandas.DataFrame({"time": hrTimes + 300, "value": BPM}
+            ).to_csv(os.path.join(directory, "ear.csv"), index=False)
+
+
+@pytest.fixture(scope="session")
+def archive(tmp_path_factory):
+    """
+    Return (root, ecgFile, watchDirectory) of the synthetic recordings
+    """
+    root = str(tmp_path_factory.mktemp("archive"))
+    ecgDirectory = os.path.join(root, "ecg-files", "DATA", ECG_START.strftime("%Y%m%d"))
+    os.makedirs(ecgDirectory)
+    ecgFile = os.path.join(ecgDirectory, ECG_START.strftime("%H-%M-%S") + ".EDF")
+    _writeEcg(ecgFile)
+
+    watchStart = ECG_START + datetime.timedelta(seconds=OFFSET)
+    watchDirectory = os.path.join(root, "files", "recordings",
+            watchStart.strftime("%Y-%m-%d"), watchStart.strftime("%H.%M.%S.000"))
+    os.makedirs(watchDirectory)
+    _writeWatch(watchDirectory)
+
+    return root, ecgFile, watchDirectory
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import batch
+import conftest
+import sync
+
+
+def test_process_pair_kalman(archive):
+    _, ecgFile, watchDirectory = archive
+    table = batch.processPair("pair", ecgFile, watchDirectory, ["kalman"])
+
+    assert (table.estimator == "kalman").all()
+    assert len(table) > 0
+    assert np.allclose(table.offset, conftest.OFFSET)
+    assert np.abs(table.error).mean() < 5
+    # Not compared with the padded start of the ECG heart-rate
+    assert table.time.min() == batch.ECG_HR_AVE_SIZE // 2
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def test_find_recordings_pairs_closest_either_way(tmp_path, capsys):
+    root = str(tmp_path)
+    ecgDirectory = os.path.join(root, "ecg-files", "DATA", "20200118")
+    watchDirectory = os.path.join(root, "files", "recordings", "2020-01-18")
+    for ecg in ["09-00-00", "12-00-00"]:
+        _touch(os.path.join(ecgDirectory, ecg + ".EDF"))
+    # Before the 09:00 ECG, between the two (closer to 12:00), and unpaired
+    for watch in ["08.59.00.000", "11.30.00.000", "20.00.00.000"]:
+        os.makedirs(os.path.join(watchDirectory, watch))
+
+    pairs = batch.findRecordings(root)
+
+    assert [(name, os.path.basename(ecg)) for name, ecg, _ in pairs] == [
+            ("2020-01-18_08.59.00", "09-00-00.EDF"),
+            ("2020-01-18_11.30.00", "12-00-00.EDF")]
+    assert "20.00.00.000" in capsys.readouterr().out
+
+
+def test_process_pair_reports_drift_model(archive):
+    _, ecgFile, watchDirectory = archive
+    table = batch.processPair("pair", ecgFile, watchDirectory, ["watch"], drift=True)
+
+    synced = sync.getSync(ecgFile, watchDirectory)
+    offset, drift = synced.getClockDrift()
+    assert np.allclose(table.offset, offset)
+    assert np.allclose(table.drift, drift)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import data
+
+
+def _jittered_times(seconds, freq, seed=0):
+    """
+    Times (ms) of samples at about freq, with jitter and dropped samples, as the watch records
+    """
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.normal(1000 / freq, 3, int(seconds * freq)))
+    return np.delete(times, rng.choice(times.size, times.size // 100, replace=False))
+
+
+@pytest.mark.parametrize("method", ["polyphase", "fft"])
+def test_signal_resample_matches_linear(method):
+    # A whole number of periods, as the fft method assumes
+    times = np.arange(6018) / 100.3
+    signal = data.getSignal(np.sin(2 * np.pi * 0.7 * times), 100.3)
+
+    linear = signal.resample(20).getValues()
+    resampled = signal.resample(20, method)
+
+    assert resampled.getFrequency() == 20
+    assert abs(resampled.size - linear.size) <= 1
+    size = min(resampled.size, linear.size)
+    assert np.allclose(resampled.getValues()[20:size - 20], linear[20:size - 20], atol=5e-3)
+
+
+@pytest.mark.parametrize("method", ["polyphase", "fft"])
+def test_timed_signal_resample_matches_linear(method):
+    times = _jittered_times(200, 25.02)
+    signal = data.getTimedSignal(np.sin(2 * np.pi * 0.7 * times / 1000), times)
+
+    linear = signal.resample(20).getValues()
+    resampled = signal.resample(20, method)
+
+    assert resampled.getFrequency() == 20
+    assert resampled.size == linear.size
+    assert np.allclose(resampled.getValues()[20:-20], linear[20:-20], atol=0.05)
+
+
+def test_timed_signal_resample_unknown_method():
+    times = _jittered_times(10, 25)
+    with pytest.raises(ValueError):
+        data.getTimedSignal(np.zeros(times.size), times).resample(20, "nearest")
+
+
+def test_signal_shares_the_source_array():
+    values = np.arange(10.0)
+    signal = data.getSignal(values, 1)
+
+    values[0] = -1
+    assert signal.getValues()[0] == -1
+    assert not signal.getValues().flags.writeable
+
+
+def test_signal_copies_on_write():
+    values = np.arange(10.0)
+    signal = data.getSignal(values, 1)
+    cropped = signal.crop(5)
+
+    signal[0] = -1
+    assert signal.getValues()[0] == -1
+    assert values[0] == 0
+    assert cropped.getValues()[0] == 0
+
+    # Once copied, it no longer follows the source
+    values[1] = -1
+    assert signal.getValues()[1] == 1
@@ -0,0 +1,30 @@
+import os
+import shutil
+import numpy as np
+import pandas
+import earbuds
+
+
+def test_synced_ear_starts_with_the_ppg(archive, tmp_path):
+    _, ecgFile, watchDirectory = archive
+    directory = str(tmp_path / "watch")
+    shutil.copytree(watchDirectory, directory)
+
+    # Ear recording starting before the watch's, whose values are their sample numbers
+    earFile = os.path.join(directory, "ear.csv")
+    ear = pandas.read_csv(earFile)
+    ear["time"] -= 2600
+    ear["value"] = np.arange(len(ear))
+    ear.to_csv(earFile, index=False)
+
+    synced = earbuds.Sync(ecgFile, directory, startCrop=20)
+    ppgTimes = pandas.read_csv(os.path.join(directory, "ppg.csv"))["time"].values
+    earTimes = ear["time"].values
+
+    # The PPG is cropped by startCrop and endCrop, then to the first ear sample after it starts
+    cropped = ppgTimes[20 * 25:-25]
+    first = cropped[cropped.size - synced.ppg.size]
+    earFirst = earTimes[int(synced.ear.getValues()[0])]
+    assert earFirst > cropped[0]
+    assert earTimes[int(synced.ear.getValues()[0]) - 1] <= cropped[0]
+    assert abs(earFirst - first) <= 20
@@ -0,0 +1,26 @@
+import numpy as np
+import data
+import filtering
+import watchdata
+
+
+def test_filter_timed_signal(archive):
+    _, _, watchDirectory = archive
+    ppg = watchdata.getWatchData(watchDirectory).getPPG()
+
+    filtered = filtering.butter_bandpass_filter(ppg, 0.4, 4)
+
+    assert isinstance(filtered, data.TimedSignal)
+    assert filtered.getFrequency() == ppg.getFrequency()
+    assert np.array_equal(filtered.getTimes(), ppg.getTimes())
+    assert filtered.size == ppg.size
+
+
+def test_filter_multi_signal():
+    values = np.random.default_rng(0).standard_normal((3, 400))
+    filtered = filtering.butter_bandpass_filter(data.MultiSignal(values, 20), 0.4, 4)
+
+    assert isinstance(filtered, data.MultiSignal)
+    for channel in range(3):
+        single = filtering.butter_bandpass_filter(data.getSignal(values[channel], 20), 0.4, 4)
+        assert np.allclose(filtered.getChannel(channel).getValues(), single.getValues())
@@ -0,0 +1,62 @@
+import numpy as np
+import conftest
+import heartrate
+import sync
+
+
+class _BlockReads:
+    """
+    An EcgData which records the number of samples in every read of the ECG
+    """
+    def __init__(self, ecgData):
+        self.ecgData = ecgData
+        self.reads = []
+
+    def __getattr__(self, name):
+        return getattr(self.ecgData, name)
+
+    def getECG(self, start=0, length=None):
+        ecg = self.ecgData.getECG(start, length)
+        self.reads.append(ecg.size)
+        return ecg
+
+
+def test_synced_ecg_range_matches_synced_ecg(archive):
+    _, ecgFile, watchDirectory = archive
+    synced = sync.getSync(ecgFile, watchDirectory)
+    start, stop = synced.getSyncedECGRange()
+
+    ecg = synced.normalize(synced.ecgData.getECG().getValues())
+    assert np.array_equal(ecg[start:stop], synced.getSyncedECG().getValues())
+
+
+def test_streamed_ecg_hr_matches_batch(archive):
+    _, ecgFile, watchDirectory = archive
+    synced = sync.getSync(ecgFile, watchDirectory)
+    whole = heartrate.get_ecg_hr(synced.getSyncedECG())
+
+    ecgData = _BlockReads(synced.ecgData)
+    synced = sync.Sync(ecgFile, watchDirectory, ecgData=ecgData, watchData=synced.watchData)
+    synced.getTimeDifference()
+    ecgData.reads.clear()
+    streamed = heartrate.get_streamed_ecg_hr(synced, block_size=7)
+
+    assert len(ecgData.reads) > 1
+    assert max(ecgData.reads) == 7 * 256
+    start, stop = synced.getSyncedECGRange()
+    assert sum(ecgData.reads) == stop - start
+    assert streamed.shape == whole.shape
+    assert np.allclose(streamed[8:], conftest.BPM, atol=1)
+    assert np.allclose(streamed[8:], whole[8:], atol=1)
+
+
+def test_running_rejection_follows_the_rate():
+    # Slowing from 150 to 50 bpm, with one missed beat
+    peaks = np.concatenate((np.arange(0, 60 * 250, 100), np.arange(60 * 250, 180 * 250, 300)))
+    peaks = np.delete(peaks, 200)
+    accepted = heartrate.reject_r_peaks_running(peaks, 250)
+
+    assert accepted[:150].all()
+    assert not accepted[200]
+    assert accepted[170:200].all() and accepted[201:].all()
+    assert not heartrate.reject_r_peaks(peaks, 250)[1:150].any()
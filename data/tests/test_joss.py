@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+import scipy.signal
+import joss
+
+
+def _reference_mfocuss(phi, y, lam, max_iters, p=0.8, prune_gamma=1e-4, epsilon=1e-8):
+    """
+    M-FOCUSS as in the MATLAB MFOCUSS, with an SVD every iteration
+    """
+    N = phi.shape[1]
+    L = y.shape[1]
+    gamma = np.ones(N)
+    keep = np.arange(N)
+    mu = None
+    for count in range(max_iters):
+        index = gamma > prune_gamma
+        gamma = gamma[index]
+        phi = phi[:, index]
+        keep = keep[index]
+
+        W = np.diag(np.sqrt(gamma))
+        U, S, Vh = np.linalg.svd(phi @ W, full_matrices=False)
+        Xi = Vh.conj().T @ np.diag(S / (S ** 2 + np.sqrt(lam) + 1e-16)) @ U.conj().T
+        mu_old = mu
+        mu = W @ Xi @ y
+        gamma = (np.sum(np.abs(mu) ** 2, axis=1) / L) ** (1 - p / 2)
+        if mu_old is not None and mu_old.shape == mu.shape:
+            if np.max(np.abs(mu_old - mu)) < epsilon:
+                break
+
+    x = np.zeros((N, L), dtype=mu.dtype)
+    x[keep, :] = mu
+    return x
+
+
+def _reference_clean(spectra, aggression=0.99):
+    """
+    Cleaning of one window's spectra, one column and bin at a time
+    """
+    spectra = spectra.copy()
+    for i in range(spectra.shape[1]):
+        spectrum = spectra[:, i]
+        spectrum[:20] = 0
+        spectrum[220:] = 0
+        spectra[:, i] = spectrum / np.max(spectrum)
+
+    accel_max = np.zeros(spectra.shape[0])
+    signal_ssr = spectra[:, 0]
+    for i in range(spectra.shape[0]):
+        accel_max[i] = np.max([spectra[i, 1], spectra[i, 2], spectra[i, 3]])
+        signal_ssr[i] = signal_ssr[i] - aggression * accel_max[i]
+    signal_ssr[signal_ssr < np.max(signal_ssr) / 4] = 0
+    return signal_ssr, accel_max
+
+
+def _reference_find_peaks(spectrum, start, stop):
+    """
+    Peaks of the spectrum masked to bins [start, stop)
+    """
+    bins = np.arange(start, stop)
+    mask = np.zeros(spectrum.size)
+    mask[bins[(bins > 0) & (bins < spectrum.size)]] = 1
+    locs, _ = scipy.signal.find_peaks(spectrum * mask)
+    return locs
+
+
+def _reference_track(spectra, freq, loc=121, bpm=121, trap_count=0):
+    """
+    Spectral peak tracking, one window at a time with masked spectra
+    """
+    hr = []
+    for spectrum in spectra:
+        N = spectrum.size
+        prev_loc, prev_bpm = loc, bpm
+        for delta in [15, 25]:
+            locs = _reference_find_peaks(spectrum, prev_loc - delta, prev_loc + delta)
+            if locs.size > 0:
+                loc = locs[np.argmax(spectrum[locs])]
+                bpm = 60 * loc / N * freq
+                break
+        else:
+            loc, bpm = prev_loc, prev_bpm
+
+        if loc == prev_loc:
+            trap_count += 1
+            if trap_count > 10:
+                loc = joss.discover_peak(spectrum, prev_loc)
+                bpm = 60 * loc / N * freq
+        else:
+            trap_count = 0
+        hr.append(bpm)
+    return np.array(hr)
+
+
+def test_debug_is_off_by_default():
+    assert not joss.DEBUG
+
+
+def test_fourier_dictionary_matches_definition():
+    M, N = 160, 1200
+    m, n = np.meshgrid(np.arange(M), np.arange(N), indexing='ij')
+    phi = joss.fourier_dictionary(M, N)
+
+    assert np.allclose(phi, np.exp(1j * 2 * np.pi * m * n / N), rtol=0, atol=1e-9)
+    assert not phi.flags.writeable
+    assert joss.fourier_dictionary(M, N) is phi
+
+
+@pytest.mark.parametrize("fourier", [False, True])
+def test_mfocuss_matches_svd_reference(fourier):
+    rng = np.random.default_rng(0)
+    M, N, L = 32, 96, 4
+    phi = np.array(joss.fourier_dictionary(M, N))
+    x = np.zeros((N, L), dtype=complex)
+    x[[7, 20, 33]] = rng.standard_normal((3, L))
+    y = (phi @ x).real + 0.01 * rng.standard_normal((M, L))
+
+    for iters in [1, 4, 20]:
+        expected = _reference_mfocuss(phi, y, 1e-10, iters)
+        assert np.allclose(joss.mfocuss(phi, y, 1e-10, iters, fourier=fourier), expected,
+                rtol=1e-6, atol=1e-9)
+
+
+def test_clean_spectra_batches_windows():
+    rng = np.random.default_rng(1)
+    spectra = rng.random((6, 1200, 4))
+    expected = [_reference_clean(window) for window in spectra]
+
+    signal_ssr, accel_max = joss.clean_spectra(spectra.copy())
+    for i, (window_ssr, window_max) in enumerate(expected):
+        assert np.allclose(signal_ssr[i], window_ssr, rtol=0, atol=1e-12)
+        assert np.allclose(accel_max[i], window_max, rtol=0, atol=1e-12)
+
+
+def test_find_peaks_in_matches_masked_spectrum():
+    rng = np.random.default_rng(2)
+    spectrum = rng.random(1200)
+    spectrum[rng.random(1200) < 0.3] = 0
+    for start, stop in [(-10, 20), (0, 1), (100, 130), (500, 550), (1180, 1230), (1199, 1300)]:
+        assert np.array_equal(joss.find_peaks_in(spectrum, start, stop),
+                _reference_find_peaks(spectrum, start, stop))
+
+
+def test_joss_track_matches_window_by_window_tracking():
+    rng = np.random.default_rng(3)
+    # A wandering peak in noise, with stretches of flat spectra to trap the tracker
+    spectra = 0.2 * rng.random((80, 1200))
+    peaks = 121 + np.cumsum(rng.integers(-6, 7, 80))
+    spectra[np.arange(80), peaks] = 1
+    spectra[30:45] = 0
+
+    expected = _reference_track(spectra, 20)
+    assert np.array_equal(joss.joss_track(spectra, 20), expected)
+    assert np.array_equal(joss.joss_track(iter(spectra), 20), expected)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import motionfilter
+
+
+def _reference_filter(ppg, accel, K, step, normalised):
+    """
+    nlms_filter and lms_filter's loop as they were first written, over numpy arrays
+    """
+    w = np.zeros(K)
+    e = np.zeros(ppg.size - K)
+    for n in range(0, ppg.size - K):
+        accel_n = accel[n+K:n:-1]
+        e_n = ppg[n+K] - np.dot(accel_n, w)
+        norm_factor = 1 / (np.dot(accel_n, accel_n) + 0.001) if normalised else 1
+        w = w + step * e_n * accel_n * norm_factor
+        e[n] = e_n
+    return e
+
+
+def _noisy_ppg(size, seed=0):
+    rng = np.random.default_rng(seed)
+    accel = 0.3 * rng.standard_normal(size)
+    motion = np.convolve(accel, [0.5, -0.3, 0.2, 0.1], mode='full')[:size]
+    ppg = np.sin(2 * np.pi * 1.2 * np.arange(size) / 25) + motion
+    return ppg, accel
+
+
+@pytest.mark.parametrize("normalised, step", [(True, 1), (False, 0.05)])
+def test_adaptive_filter_matches_original_loop(normalised, step, monkeypatch):
+    ppg, accel = _noisy_ppg(2000)
+    expected = _reference_filter(ppg, accel, 15, step, normalised)
+
+    assert np.allclose(motionfilter.adaptive_filter(ppg, accel, 15, step, normalised),
+            expected, rtol=1e-9, atol=1e-12)
+
+    # The NumPy/BLAS loop, used when numba isn't installed
+    monkeypatch.setattr(motionfilter, "numba", None)
+    assert np.allclose(motionfilter.adaptive_filter(ppg, accel, 15, step, normalised),
+            expected, rtol=1e-9, atol=1e-12)
+
+
+def test_compiled_loop_matches_original_loop():
+    ppg, accel = _noisy_ppg(1000)
+    K = 15
+    taps = motionfilter._tap_matrix(accel, K)
+    norms = np.einsum('ij,ij->i', taps, taps) + motionfilter.NLMS_EPSILON
+    e = np.empty(ppg.size - K)
+    w = np.zeros((1, K))
+
+    motionfilter._adaptive_loop_compiled(ppg[K:], accel[np.newaxis], norms, 1.0, e, w)
+    assert np.allclose(e, _reference_filter(ppg, accel, K, 1, True), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+def test_streaming_filter_matches_original_loop(channels):
+    ppg, accel = _noisy_ppg(2000)
+    K = 15
+    references = np.array([accel * (c + 1) for c in range(channels)])
+    if channels == 1:
+        expected = _reference_filter(ppg, accel, K, 1, True)
+    else:
+        expected = motionfilter.adaptive_filter(ppg, references, K)
+
+    # Chunks shorter than the taps, so boundaries fall inside the carried history
+    bounds = np.cumsum([0, 7, 3, 1, 22, 14, 200, 9, 1000])
+    bounds = np.append(bounds[bounds < ppg.size], ppg.size)
+    stream = motionfilter.StreamingFilter(K=K, step=1, channels=channels)
+    chunks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        size = stream.output_size(stop - start)
+        chunk = stream.process(ppg[start:stop], references[:, start:stop])
+        assert chunk.size == size
+        chunks.append(chunk)
+
+    assert chunks[0].size == 0 and chunks[1].size == 0
+    assert np.allclose(np.concatenate(chunks), expected, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,81 @@
+import numpy as np
+import data
+import peakfind
+
+
+def _reference_min_sd(signal, window_size=0.75):
+    """
+    find_peaks_min_sd as it was first written, one threshold at a time
+    """
+    values = signal.getValues()
+    freq = signal.getFrequency()
+    window = int(window_size * freq)
+    mov_ave = np.convolve(values, np.array([1/window for _ in range(window)]), mode='valid')
+    missing = np.full(int((values.size - mov_ave.size) / 2), np.mean(values))
+    mov_ave = np.concatenate((missing, mov_ave, missing))
+
+    min_sd = np.inf
+    current_peaks = []
+    for perc in peakfind.MIN_SD_PERCS:
+        x_peaks = (values > mov_ave + mov_ave * perc / 100).nonzero()[0]
+        y_peaks = values[x_peaks]
+        peak_edges = (np.diff(x_peaks) > 1).nonzero()[0] + 1
+
+        peaks = []
+        for i in range(len(peak_edges) - 1):
+            ys = y_peaks[peak_edges[i]:peak_edges[i+1]].tolist()
+            if len(ys) > 0:
+                peaks.append(x_peaks[peak_edges[i] + ys.index(max(ys))])
+
+        sd = np.std(np.diff(peaks) / freq) if len(peaks) > 1 else np.nan
+        rate = len(peaks) / (values.size / freq) * 60
+        if sd < min_sd and 40 <= rate <= 240:
+            min_sd = sd
+            current_peaks = peaks
+
+    return np.array(current_peaks)
+
+
+def _quantised_ppg(seconds, decimals, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.arange(seconds * 20) / 20
+    values = np.sin(2 * np.pi * 1.2 * times) + 0.3 * rng.standard_normal(times.size) + 2
+    return np.round(values, decimals)
+
+
+def test_min_sd_matches_reference_on_quantised_input():
+    values = _quantised_ppg(600, 1)
+    for start in range(0, values.size - 600, 200):
+        signal = data.getSignal(values[start:start + 600], 20)
+        assert np.array_equal(peakfind.find_peaks_min_sd(signal), _reference_min_sd(signal))
+
+
+def test_moving_mean_matches_convolve():
+    values = _quantised_ppg(1000, 1)
+    whole = peakfind.moving_mean(values, 15)
+    assert np.allclose(whole, np.convolve(values, np.full(15, 1 / 15), mode='valid'),
+            rtol=0, atol=1e-12)
+
+    average = peakfind.MovingAverage(15)
+    streamed = np.concatenate([average.process(chunk) for chunk in np.array_split(values, 7)])
+    assert np.allclose(streamed, whole, rtol=0, atol=1e-12)
+
+
+def test_exact_means_match_convolve():
+    values = _quantised_ppg(100, 1)
+    means = np.convolve(values, np.full(15, 1 / 15), mode='valid')
+    starts = np.arange(0, means.size, 7)
+    assert np.array_equal(peakfind.exact_means(values, 15, starts), means[starts])
+
+
+def test_sliding_rates_match_each_window():
+    values = _quantised_ppg(600, 1)
+    values[3000:4000] = 2
+    seconds = np.arange(30, 599)
+    windows = np.stack((20 * (seconds - 30), 20 * seconds), axis=1)
+    signal = data.getSignal(values, 20)
+
+    rates = peakfind.sliding_rates_min_sd(signal, windows)
+    expected = [peakfind.get_rate_min_sd(data.getSignal(values[start:stop], 20))
+            for start, stop in windows]
+    assert np.array_equal(rates, expected)
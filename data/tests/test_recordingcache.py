@@ -0,0 +1,80 @@
+import os
+import shutil
+import numpy as np
+import ecgdata
+import recordingcache
+import watchdata
+
+
+def _copyArchive(archive, tmp_path):
+    """
+    Copy the synthetic recordings, so their caches don't affect the other tests
+    """
+    _, ecgFile, watchDirectory = archive
+    ecgCopy = str(tmp_path / os.path.basename(ecgFile))
+    watchCopy = str(tmp_path / "watch")
+    shutil.copy(ecgFile, ecgCopy)
+    shutil.copytree(watchDirectory, watchCopy)
+    return ecgCopy, watchCopy
+
+
+def test_cached_ecg_reads_equal_direct_reads(archive, tmp_path):
+    ecgFile, _ = _copyArchive(archive, tmp_path)
+    direct = ecgdata.EcgData(ecgFile)
+    expected = {label: (direct.getFrequency(label), direct.getChannel(label).getValues(),
+            direct.getChannel(label, 10.5, 20).getValues()) for label in direct.labels}
+    direct.ecgFile.close()
+
+    recordingcache.convert(ecgFile)
+    assert recordingcache.isFresh(ecgFile)
+    cached = ecgdata.EcgData(ecgFile)
+    assert cached.ecgFile is None
+
+    for label, (frequency, whole, part) in expected.items():
+        assert cached.getFrequency(label) == frequency
+        assert np.array_equal(cached.getChannel(label).getValues(), whole)
+        assert np.array_equal(cached.getChannel(label, 10.5, 20).getValues(), part)
+
+
+def test_cached_columns_equal_parsed_columns(archive, tmp_path):
+    _, watchDirectory = _copyArchive(archive, tmp_path)
+    parsed = {fileName: watchdata.readColumns(
+            os.path.join(watchDirectory, fileName), columns)
+            for fileName, columns in watchdata.COLUMNS.items()
+            if os.path.isfile(os.path.join(watchDirectory, fileName))}
+
+    recordingcache.convert(watchDirectory)
+    for fileName, columns in parsed.items():
+        path = os.path.join(watchDirectory, fileName)
+        assert recordingcache.isFresh(path)
+        cached = watchdata.loadColumns(path, watchdata.COLUMNS[fileName])
+        assert set(cached) == set(columns)
+        for name, values in columns.items():
+            assert isinstance(cached[name], np.memmap)
+            assert np.array_equal(cached[name], values)
+
+
+def test_stale_source_rebuilds_cache(archive, tmp_path):
+    _, watchDirectory = _copyArchive(archive, tmp_path)
+    path = os.path.join(watchDirectory, "hr.csv")
+    recordingcache.convert(watchDirectory)
+    size = watchdata.loadColumns(path, watchdata.COLUMNS["hr.csv"])["time"].size
+
+    # Touched, so only the modification time changes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not recordingcache.isFresh(path)
+    assert recordingcache.load(path) is None
+    recordingcache.convert(watchDirectory)
+    assert recordingcache.isFresh(path)
+
+    # A row added, so the size changes too
+    with open(path, "a") as f:
+        f.write("99999999999999,61.0,3\n")
+    assert not recordingcache.isFresh(path)
+    assert watchdata.loadColumns(path, watchdata.COLUMNS["hr.csv"])["time"].size == size + 1
+    recordingcache.convert(watchDirectory)
+    cached = recordingcache.load(path)
+    assert cached is not None
+    assert cached[0]["time"].size == size + 1
+    assert cached[0]["time"][-1] == 99999999999999
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import scipy.signal
+import sync
+
+
+def test_fast_correlate_matches_correlate():
+    rng = np.random.default_rng(0)
+    f = rng.standard_normal(3000)
+    g = f[1234:2234] + 0.1 * rng.standard_normal(1000)
+
+    assert sync.fastCorrelate(f, g, 8) == sync.correlate(f, g)
+    assert sync.fastCorrelate(f, g, 8)[0] == 1234
+
+
+def _bruteLag(f, g, maxLag):
+    """
+    The lag maximising the absolute cross correlation averaged over the overlap, from every lag
+    """
+    c = scipy.signal.correlate(f, g, mode='full')
+    lags = np.arange(c.size) - (g.size - 1)
+    overlap = np.minimum(f.size, g.size + lags) - np.maximum(lags, 0)
+    inRange = np.absolute(lags) <= maxLag
+    return lags[inRange][np.argmax(np.absolute(c[inRange]) / overlap[inRange])]
+
+
+@pytest.mark.parametrize("lag", [-613, -250, -37, 0, 5, 129, 400, 777])
+def test_pyramid_correlate_matches_brute_force(lag):
+    rng = np.random.default_rng(abs(lag))
+    # Smooth noise, like the acceleration sync correlates, at 64 Hz
+    base = np.convolve(rng.standard_normal(8000), np.ones(16) / 16, mode='same')
+    f = base[1000:5000]
+    g = base[1000 + lag:4000 + lag] + 0.05 * rng.standard_normal(3000)
+
+    k, v = sync.pyramidCorrelate(f, g, 64, 1000)
+    assert k == _bruteLag(f, g, 1000) == lag
+    assert np.isclose(v, np.dot(f[max(k, 0):g.size + k], g[max(-k, 0):f.size - k]))
@@ -3,90 +3,164 @@ Helper class to aid extraction of data from information downloaded from
 the watch.
 """
 import pandas
+import numpy as np
 import os.path
 import data
+import recordingcache
+
+# Columns, and their types, which we use from each file recorded by the watch.
+# "value" also matches value2, value3, ... (the PPG file has one value column
+# per light sensor).
+COLUMNS = {
+    "ppg.csv": {"time": np.int64, "value": np.float64},
+    "accelerometer.csv": {"time": np.int64, "x": np.float64, "y": np.float64, 
+        "z": np.float64},
+    "rotation.csv": {"time": np.int64, "x": np.float64, "y": np.float64, 
+        "z": np.float64},
+    "hr.csv": {"time": np.int64, "value": np.float64, "accuracy": np.int64},
+    "ear.csv": {"time": np.int64, "value": np.float64},
+}
 
 def getWatchData(directory):
     return WatchData(directory)
 
 
+def readColumns(path, columns):
+    """
+    Parse a recording CSV file in a single pass, keeping only the columns we use.
+
+    Parameters
+    ----------
+    path : str
+        The CSV file to read.
+
+    columns : dict
+        Maps column names to their dtypes. Any column starting with "value" is
+        read when "value" is requested, so all PPG sensors come from one parse.
+
+    Returns
+    -------
+    out : dict
+        Maps each column name read to a numpy array of its values.
+    """
+    header = pandas.read_csv(path, nrows=0).columns
+    dtypes = {}
+    for column in header:
+        if column in columns:
+            dtypes[column] = columns[column]
+        elif "value" in columns and column.startswith("value"):
+            dtypes[column] = columns["value"]
+
+    df = pandas.read_csv(path, usecols=list(dtypes), dtype=dtypes)
+    return {column: df[column].to_numpy() for column in df.columns}
+
+
+def loadColumns(path, columns):
+    """
+    Return the columns of a recording CSV file, from its binary cache (see
+    recordingcache) if that is fresh, otherwise by parsing the file.
+    """
+    cached = recordingcache.load(path)
+    if cached is not None:
+        return cached[0]
+    return readColumns(path, columns)
+
+
 class WatchData:
     """
     Constructor, takes directory in which data files for the recording can be
     found.
+
+    Each file is parsed at most once, the first time any of its columns are
+    needed, and its columns are then shared between all the getters.
     """
     def __init__(self, directory):
         if not os.path.isdir(directory):
             raise IOError("Directory {} does not exist".format(directory))
         self.directory = directory
+        self._columns = {}
+
+    def _getColumns(self, fileName):
+        """
+        Return the columns of fileName as a dict of numpy arrays, parsing it if
+        this is the first time it is used.
+        """
+        if fileName not in self._columns:
+            self._columns[fileName] = loadColumns(
+                    os.path.join(self.directory, fileName), COLUMNS[fileName])
+        return self._columns[fileName]
+
+    def _getFrequency(self, fileName):
+        """
+        Calculate the average sampling frequency (hz) of fileName from its timestamps
+        """
+        return data.averageFrequency(self._getColumns(fileName)['time'])
+
+    def clearCache(self):
+        """
+        Forget all parsed files, so they are read again next time they are used.
+        """
+        self._columns.clear()
         
     
     """
-    Return the PPG signal as a numpy array, along with its frequency (hz)
+    Return the PPG signal as a data.TimedSignal, with its average frequency (hz)
     """
     def getPPG(self, sensor=1):
-        df = pandas.read_csv(os.path.join(self.directory, "ppg.csv"))
+        columns = self._getColumns("ppg.csv")
         sensor = "" if sensor==1 else str(sensor)
-        ppg = df['value'+sensor].to_numpy()
-        time = df['time'].to_numpy()
+        ppg = columns['value'+sensor]
 
         # Calculate frequency in hz
-        freq = time.size / ((time[time.size-1] - time[0]) / 1000)
-        return data.getSignal(ppg, freq)
+        freq = self._getFrequency("ppg.csv")
+        return data.getTimedSignal(ppg, columns['time'], freq)
 
     """
     Return the PPG signal as a numpy array, along with its frequency (hz)
     """
     @property
     def times(self):
-        df = pandas.read_csv(os.path.join(self.directory, "ppg.csv"))
-        time = df['time'].to_numpy()
-        return time
+        time = self._getColumns("ppg.csv")['time']
+        return time.copy()
 
 
     """
-    Return an acceletation signal axis (x, y or z) as a signal object
+    Return an acceletation signal axis (x, y or z) as a data.TimedSignal
     """
     def getAcceleration(self, axis):
         if not axis in ['x','y','z']:
             raise ValueError("Argument axis must be one of x, y or z.")
 
-        df = pandas.read_csv(os.path.join(self.directory, 
-            "accelerometer.csv"))
-        signal = df[axis].to_numpy()
-        time = df['time'].to_numpy()
+        columns = self._getColumns("accelerometer.csv")
 
         # Calculate frequency in hz
-        freq = time.size / ((time[time.size-1] - time[0]) / 1000)
-        return data.getSignal(signal, freq)
+        freq = self._getFrequency("accelerometer.csv")
+        return data.getTimedSignal(columns[axis], columns['time'], freq)
 
 
     """
-    Return the rotation signal axis (x, y or z) as a signal object 
+    Return the rotation signal axis (x, y or z) as a data.TimedSignal
     """
     def getRotation(self, axis):
         if not axis in ['x','y','z']:
             raise ValueError("Argument axis must be one of x, y or z.")
 
-        df = pandas.read_csv(os.path.join(self.directory, "rotation.csv"))
-        signal = df[axis].to_numpy()
-        time = df['time'].to_numpy()
+        columns = self._getColumns("rotation.csv")
 
         # Calculate frequency in hz
-        freq = time.size / ((time[time.size-1] - time[0]) / 1000)
-        return data.getSignal(signal, freq)
+        freq = self._getFrequency("rotation.csv")
+        return data.getTimedSignal(columns[axis], columns['time'], freq)
 
     """
     Return the heart-rate signal as a signal object
     also return the accuracy integers as a signal object
     """
     def getHR(self):
-        df = pandas.read_csv(os.path.join(self.directory, "hr.csv"))
-        hr = df['value'].to_numpy()
-        accuracy = df['accuracy'].to_numpy()
-        time = df['time'].to_numpy()
+        columns = self._getColumns("hr.csv")
+        hr = columns['value']
+        accuracy = columns['accuracy']
 
         # Calculate frequency in hz
         freq = 1
-        return data.getSignal(hr, freq), data.getSignal(accuracy, freq)
-
+        return (data.getTimedSignal(hr, columns['time'], freq), 
+                data.getTimedSignal(accuracy, columns['time'], freq))